@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+
+class TokenBucketLimiter:
+    """Token bucket bounding request rate and concurrency against an HTTP API.
+
+    Tokens refill continuously at `rate` per second up to `capacity`. Callers that
+    see X-Ratelimit-* response headers (Horizon sends them) can pass them to
+    update_from_headers to lower the refill rate when the server reports less headroom.
+    """
+
+    def __init__(self, rate=10.0, capacity=20, max_concurrency=32, min_rate=0.5):
+        self.base_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def acquire(self):
+        await self.semaphore.acquire()
+        try:
+            async with self.lock:
+                while True:
+                    now = time.monotonic()
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                    self.updated_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    def release(self):
+        self.semaphore.release()
+
+    def update_from_headers(self, headers):
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        try:
+            remaining = int(headers["x-ratelimit-remaining"])
+            reset = max(float(headers["x-ratelimit-reset"]), 1.0)
+        except (KeyError, ValueError):
+            return
+        self.rate = min(self.base_rate, max(self.min_rate, remaining / reset))
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
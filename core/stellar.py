@@ -3,19 +3,116 @@ from stellar_sdk.call_builder.call_builder_async import AccountsCallBuilder as A
 from stellar_sdk.call_builder.call_builder_async import TransactionsCallBuilder as AsyncTransactionsCallBuilder
 from stellar_sdk.call_builder.call_builder_async import LedgersCallBuilder as AsyncLedgersCallBuilder
 from stellar_sdk import Account
+from stellar_sdk.xdr import TransactionResult, TransactionResultCode
 from stellar_sdk.client.aiohttp_client import AiohttpClient
 from stellar_sdk.client.response import Response as StellarResponse
+from stellar_sdk.exceptions import ConnectionError as StellarConnectionError
 import aiohttp
+import orjson
 import asyncio
+import gzip
+import random
 import time
+from functools import lru_cache
+from hashlib import sha256
+from statistics import median
+from urllib.parse import urlencode
 import logging
 
 TESTNET = Network.PUBLIC_NETWORK_PASSPHRASE
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=8)
+def cached_network_id(network_passphrase):
+    return sha256(network_passphrase.encode()).digest()
+
+# Every TransactionEnvelope (builder.build(), from_xdr, local signing) re-hashes the
+# passphrase via Network.network_id(); the passphrase never changes, so memoize it.
+Network.network_id = lambda self: cached_network_id(self.network_passphrase)
+
 logger.info("Loaded core/stellar.py")
 
+class OrjsonResponse(StellarResponse):
+    """stellar_sdk Response that decodes its body with orjson; call builders use .json() for every payload."""
+
+    @classmethod
+    def wrap(cls, response):
+        return cls(response.status_code, response.text, response.headers, response.url)
+
+    def json(self):
+        return orjson.loads(self.text)
+
+class PooledAiohttpClient(AiohttpClient):
+    """AiohttpClient backed by a tuned keep-alive connector, shared by all call builders.
+
+    When a rate_limiter is given, every GET/POST waits for a token first. Transaction
+    submissions are gzipped until Horizon rejects a compressed body once.
+    """
+
+    # AiohttpClient's own options; any other keyword arguments are passed to the ClientSession
+    _CLIENT_OPTIONS = ("request_timeout", "post_timeout", "backoff_factor", "user_agent", "custom_headers")
+
+    def __init__(self, limit=200, limit_per_host=32, keepalive_timeout=75, ttl_dns_cache=300, rate_limiter=None, compress_submissions=True, **kwargs):
+        client_options = {key: kwargs.pop(key) for key in self._CLIENT_OPTIONS if key in kwargs}
+        super().__init__(pool_size=limit, **client_options)
+        self.rate_limiter = rate_limiter
+        self.compress_submissions = compress_submissions
+        connector = aiohttp.TCPConnector(
+            limit=limit,
+            limit_per_host=limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+            ttl_dns_cache=ttl_dns_cache,
+            enable_cleanup_closed=True
+        )
+        # AiohttpClient only opens its default session lazily when _session is unset, so
+        # installing the tuned one here means the parent never creates a second session
+        self._session = aiohttp.ClientSession(
+            headers=self.headers.copy(),
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+            **kwargs
+        )
+
+    async def get(self, url, params=None):
+        if self.rate_limiter is None:
+            return OrjsonResponse.wrap(await super().get(url, params=params))
+        async with self.rate_limiter:
+            response = await super().get(url, params=params)
+        self.rate_limiter.update_from_headers(response.headers)
+        return OrjsonResponse.wrap(response)
+
+    async def post(self, url, data=None, json_data=None):
+        if self.rate_limiter is None:
+            return OrjsonResponse.wrap(await super().post(url, data=data, json_data=json_data))
+        async with self.rate_limiter:
+            response = await super().post(url, data=data, json_data=json_data)
+        self.rate_limiter.update_from_headers(response.headers)
+        return OrjsonResponse.wrap(response)
+
+    async def post_form(self, url, form, compress=True):
+        """POST a urlencoded form straight through the session, gzipping the body when compress is set."""
+        body = urlencode(form).encode()
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        if compress:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        if self.rate_limiter is None:
+            return await self._post_raw(url, body, headers)
+        async with self.rate_limiter:
+            response = await self._post_raw(url, body, headers)
+        self.rate_limiter.update_from_headers(response.headers)
+        return response
+
+    async def _post_raw(self, url, body, headers):
+        # Same timeout and error contract as AiohttpClient.post
+        try:
+            async with self._session.post(
+                url, data=body, headers=headers, timeout=aiohttp.ClientTimeout(total=self.post_timeout)
+            ) as response:
+                return OrjsonResponse(response.status, await response.text(), dict(response.headers), url)
+        except aiohttp.ClientError as e:
+            raise StellarConnectionError(e)
+
 async def load_public_key(self, telegram_id):
     async with self.db_pool_nitro.acquire() as conn:
         row = await conn.fetchrow("SELECT public_key FROM users WHERE telegram_id = $1", telegram_id)
@@ -32,53 +129,78 @@ def parse_asset(asset_data):
                      asset_data.get("issuer", asset_data.get("asset_issuer")))
     return None
 
-async def has_trustline(account, asset):
+def build_trustline_index(account):
+    """Index an account's balances by (asset_code, asset_issuer); native is keyed as ("native", None)."""
     if isinstance(account, dict):
         balances = account.get("balances", [])
     else:
         balances = account.raw_data.get("balances", [])
-    for balance in balances:
-        if asset.is_native() and balance["asset_type"] == "native":
-            return True
-        elif (balance["asset_type"] != "native" and
-              balance["asset_code"] == asset.code and
-              balance["asset_issuer"] == asset.issuer):
-            return True
-    return False
+    return {
+        ("native", None) if b["asset_type"] == "native" else (b.get("asset_code"), b.get("asset_issuer")): b
+        for b in balances
+    }
+
+async def has_trustline(account, asset, index=None):
+    """Check for a trustline; pass a prebuilt index when checking several assets on one account."""
+    if index is None:
+        index = build_trustline_index(account)
+    key = ("native", None) if asset.is_native() else (asset.code, asset.issuer)
+    return key in index
 
 async def load_account_async(public_key, app_context):
     builder = AsyncAccountsCallBuilder(horizon_url=app_context.horizon_url, client=app_context.client).account_id(public_key)
     return await builder.call()
 
+ACCOUNT_CACHE_TTL = 1.5
+
+async def load_account_cached(public_key, app_context, ttl=ACCOUNT_CACHE_TTL):
+    """load_account_async with a short TTL for display paths (balance, welcome); never use it to build transactions."""
+    cached = app_context.account_cache.get(public_key)
+    if cached is not None and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    account = await load_account_async(public_key, app_context)
+    app_context.account_cache[public_key] = (time.monotonic(), account)
+    return account
+
+FEE_CACHE_TTL = 4.0  # Seconds; ledgers close roughly every 5s
+
 async def get_recommended_fee(app_context):
+    """Return the recommended base fee, shared across callers for FEE_CACHE_TTL seconds."""
+    cached_at, fee = app_context.fee_cache
+    if fee is not None and time.monotonic() - cached_at < FEE_CACHE_TTL:
+        return fee
+    async with app_context.fee_lock:
+        cached_at, fee = app_context.fee_cache
+        if fee is not None and time.monotonic() - cached_at < FEE_CACHE_TTL:
+            return fee
+        fee = await fetch_recommended_fee(app_context)
+        app_context.fee_cache = (time.monotonic(), fee)
+        return fee
+
+async def fetch_recommended_fee(app_context):
+    try:
+        response = await app_context.client.get(f"{app_context.horizon_url}/fee_stats")
+        return int(response.json()["max_fee"]["p50"])
+    except Exception as e:
+        logger.warning(f"fee_stats unavailable, falling back to latest ledger fees: {str(e)}")
+    return await fetch_recommended_fee_from_ledger(app_context)
+
+async def fetch_recommended_fee_from_ledger(app_context):
     try:
         ledger_builder = AsyncLedgersCallBuilder(horizon_url=app_context.horizon_url, client=app_context.client).order("desc").limit(1)
         ledger = await ledger_builder.call()
         latest_ledger = ledger["_embedded"]["records"][0]["sequence"]
         tx_builder = AsyncTransactionsCallBuilder(horizon_url=app_context.horizon_url, client=app_context.client).for_ledger(latest_ledger)
         transactions = await tx_builder.call()
-        fees = [int(tx["max_fee"]) for tx in transactions["_embedded"]["records"]]
-        if not fees:
-            return 10000
-        fees.sort()
-        mid = len(fees) // 2
-        return (fees[mid] + fees[mid - 1]) // 2 if len(fees) % 2 == 0 else fees[mid]
+        fees = list(map(int, (tx["max_fee"] for tx in transactions["_embedded"]["records"])))
+        return int(median(fees)) if fees else 10000
     except Exception as e:
         logger.error(f"Failed to fetch recommended fee: {str(e)}", exc_info=True)
         return 10000
 
-async def build_and_submit_transaction(telegram_id, db_pool, operations, app_context, memo=None, base_fee=None):
-    """Build and submit a transaction using the enclave for signing."""
-    public_key = await app_context.load_public_key(telegram_id)
-    account_data = await load_account_async(public_key, app_context)
-    sequence = int(account_data["sequence"])
+def build_transaction_xdr(public_key, sequence, operations, base_fee, memo=None):
+    """Build an unsigned transaction envelope XDR for the given source account state."""
     account = Account(account=public_key, sequence=sequence)
-    
-    if base_fee is None:
-        recommended_fee = await get_recommended_fee(app_context)
-        base_fee = max(recommended_fee, 200 * len(operations))
-    logger.info(f"Using base fee: {base_fee} stroops for {len(operations)} operations")
-    
     tx_builder = TransactionBuilder(
         source_account=account,
         network_passphrase=TESTNET,
@@ -91,49 +213,221 @@ async def build_and_submit_transaction(telegram_id, db_pool, operations, app_con
         tx_builder.add_text_memo(memo)
     
     tx = tx_builder.build()
-    xdr = tx.to_xdr()
-    
-    # Send to enclave for signing
-    signed_xdr = await app_context.sign_transaction(telegram_id, xdr)
-    tx_envelope = TransactionEnvelope.from_xdr(signed_xdr, TESTNET)
+    return tx.to_xdr()
+
+class TransactionSubmitError(Exception):
+    """Horizon rejected a submission; keeps the response so callers can inspect the result code."""
+
+    def __init__(self, message, response_dict):
+        super().__init__(message)
+        self.response = response_dict
+
+    @property
+    def result_code(self):
+        error_result_xdr = self.response.get("error_result_xdr")
+        if not error_result_xdr:
+            return None
+        try:
+            return TransactionResult.from_xdr(error_result_xdr).result.code
+        except Exception:
+            return None
+
+# Statuses a server or proxy returns when it can't accept a gzipped body; 429 and others are real errors
+_COMPRESSION_REJECTED_STATUSES = (400, 413, 415)
+
+def _response_dict(response):
+    """Decode a submission response body, tolerating non-JSON error pages from proxies."""
+    try:
+        return response.json()
+    except orjson.JSONDecodeError:
+        return {}
+
+async def submit_signed_xdr(signed_xdr, app_context):
+    """Submit a signed envelope to /transactions_async and return Horizon's response dict."""
+    # Reject malformed enclave output before submitting; XDR parsing runs off the event loop
+    await asyncio.to_thread(TransactionEnvelope.from_xdr, signed_xdr, TESTNET)
     
     url = f"{app_context.horizon_url}/transactions_async"
-    response = await app_context.client.post(url, data={"tx": signed_xdr})
-    
-    if isinstance(response, dict):
-        response_dict = response
-    elif isinstance(response, StellarResponse):
-        response_dict = response.json()
-    elif isinstance(response, aiohttp.ClientResponse):
-        response_dict = await response.json()
+    client = app_context.client
+    if getattr(client, "compress_submissions", False):
+        response = await client.post_form(url, {"tx": signed_xdr})
+        response_dict = _response_dict(response)
+        # One of these without tx_status means the gzipped body wasn't readable, not that the tx failed
+        if response.status_code in _COMPRESSION_REJECTED_STATUSES and "tx_status" not in response_dict:
+            logger.warning(f"Horizon rejected compressed submission ({response.status_code}); sending uncompressed from now on")
+            client.compress_submissions = False
+            response = await client.post_form(url, {"tx": signed_xdr}, compress=False)
+            response_dict = _response_dict(response)
     else:
-        raise Exception(f"Unexpected response type from client.post: {type(response)}")
+        response = await client.post(url, data={"tx": signed_xdr})
+        response_dict = response.json()  # AiohttpClient.post always returns a stellar_sdk Response
     
     if "tx_status" not in response_dict or response_dict.get("tx_status") == "ERROR":
         logger.error(f"Transaction submission failed: {response_dict}")
-        raise Exception(f"Transaction failed: {response_dict.get('title', 'Unknown error')}, details: {response_dict.get('detail', 'No details')}")
+        raise TransactionSubmitError(
+            f"Transaction failed: {response_dict.get('title', 'Unknown error')}, details: {response_dict.get('detail', 'No details')}",
+            response_dict
+        )
     
     logger.info(f"Transaction submitted: {response_dict}")
-    return response_dict, signed_xdr
+    return response_dict
 
-async def wait_for_transaction_confirmation(tx_hash, app_context, max_attempts=30, interval=2):
-    logger.info(f"Waiting for transaction confirmation: {tx_hash}")
-    attempts = 0
-    while attempts < max_attempts:
+async def next_sequence(public_key, app_context):
+    """Return (sequence, from_cache) for public_key, loading from Horizon on a cache miss."""
+    cached = app_context.sequence_cache.get(public_key)
+    if cached is not None:
+        return cached, True
+    account_data = await load_account_async(public_key, app_context)
+    return int(account_data["sequence"]), False
+
+# stellar-core holds one pending transaction per source account and answers TRY_AGAIN_LATER
+# while another is queued; the ledger closes every ~5s, so back off across a few closes
+TRY_AGAIN_LATER_RETRIES = 5
+TRY_AGAIN_LATER_BACKOFF = 1.0
+
+async def submit_until_accepted(signed_xdr, app_context):
+    """Submit signed_xdr, resubmitting the same envelope while Horizon answers TRY_AGAIN_LATER.
+
+    Raises TransactionSubmitError if the transaction is still deferred after
+    TRY_AGAIN_LATER_RETRIES retries, so callers never mistake it for a submitted one.
+    """
+    for attempt in range(TRY_AGAIN_LATER_RETRIES + 1):
+        response_dict = await submit_signed_xdr(signed_xdr, app_context)
+        if response_dict.get("tx_status") != "TRY_AGAIN_LATER":
+            return response_dict
+        if attempt < TRY_AGAIN_LATER_RETRIES:
+            delay = TRY_AGAIN_LATER_BACKOFF * 2 ** attempt
+            logger.warning("Horizon returned TRY_AGAIN_LATER, resubmitting in %.1fs", delay)
+            await asyncio.sleep(delay)
+    raise TransactionSubmitError(
+        f"Transaction still deferred (TRY_AGAIN_LATER) after {TRY_AGAIN_LATER_RETRIES} retries",
+        response_dict
+    )
+
+async def build_and_submit_transaction(telegram_id, db_pool, operations, app_context, memo=None, base_fee=None, user_data=None):
+    """Build and submit a transaction using the enclave for signing.
+
+    The account sequence is tracked locally in app_context.sequence_cache, so Horizon is
+    only queried on first use or after a rejected submission. A tx_bad_seq on a cached
+    sequence (e.g. the account was used elsewhere) reloads it and retries once. A
+    TRY_AGAIN_LATER is resubmitted with backoff and raises TransactionSubmitError if it persists.
+    user_data (from app_context.load_signing_user) skips the public key and key material lookups.
+    """
+    public_key = user_data["public_key"] if user_data else await app_context.load_public_key(telegram_id)
+    
+    if base_fee is None:
+        recommended_fee = await get_recommended_fee(app_context)
+        base_fee = max(recommended_fee, 200 * len(operations))
+    logger.info("Using base fee: %s stroops for %s operations", base_fee, len(operations))
+    
+    async with app_context.sequence_locks[public_key]:
+        while True:
+            sequence, from_cache = await next_sequence(public_key, app_context)
+            # Building/serializing multi-op transactions is CPU-bound; keep it off the event loop
+            xdr = await asyncio.to_thread(build_transaction_xdr, public_key, sequence, operations, base_fee, memo)
+            
+            # Send to enclave for signing
+            signed_xdr = await app_context.sign_transaction(telegram_id, xdr, user_data=user_data)
+            app_context.account_cache.pop(public_key, None)
+            try:
+                response_dict = await submit_until_accepted(signed_xdr, app_context)
+            except TransactionSubmitError as e:
+                app_context.sequence_cache.pop(public_key, None)
+                if from_cache and e.result_code == TransactionResultCode.txBAD_SEQ:
+                    logger.warning("Cached sequence for %s was stale, reloading from Horizon", public_key)
+                    continue
+                raise
+            except Exception:
+                app_context.sequence_cache.pop(public_key, None)
+                raise
+            
+            # PENDING or DUPLICATE: TRY_AGAIN_LATER raised above and ERROR in submit_signed_xdr
+            app_context.sequence_cache[public_key] = sequence + 1
+            return response_dict, signed_xdr
+
+class TransactionConfirmationStream:
+    """One Horizon /transactions SSE subscription shared by every pending confirmation.
+
+    Waiters register a hash and get a future that resolves with the transaction record
+    when it appears on the stream. The consumer task starts on the first watch and exits
+    once nothing is pending.
+    """
+
+    def __init__(self, app_context):
+        self.app_context = app_context
+        self.pending = {}
+        self.task = None
+
+    def watch(self, tx_hash):
+        future = self.pending.get(tx_hash)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[tx_hash] = future
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.consume())
+        return future
+
+    def discard(self, tx_hash):
+        self.pending.pop(tx_hash, None)
+
+    async def consume(self):
+        builder = AsyncTransactionsCallBuilder(horizon_url=self.app_context.horizon_url, client=self.app_context.client).cursor("now")
         try:
-            builder = AsyncTransactionsCallBuilder(horizon_url=app_context.horizon_url, client=app_context.client).transaction(tx_hash)
-            tx = await builder.call()
-            if tx["successful"]:
-                logger.info(f"Transaction {tx_hash} confirmed successfully")
-                return tx
-            elif "successful" in tx and not tx["successful"]:
+            async for tx in builder.stream():
+                future = self.pending.pop(tx.get("hash"), None)
+                if future is not None and not future.done():
+                    future.set_result(tx)
+                if not self.pending:
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Waiters keep polling, so a dropped stream only costs latency
+            logger.warning(f"Transaction confirmation stream failed: {str(e)}")
+
+    async def close(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+async def wait_for_transaction_confirmation(tx_hash, app_context, max_attempts=30, interval=2, initial_delay=0.3):
+    """Wait for tx_hash via the shared SSE stream, polling Horizon with backoff as a fallback.
+
+    Polls back off from initial_delay up to interval; gives up after max_attempts * interval
+    seconds. Without a confirmation_stream on app_context this is plain polling.
+    """
+    logger.info(f"Waiting for transaction confirmation: {tx_hash}")
+    stream = getattr(app_context, "confirmation_stream", None)
+    streamed = stream.watch(tx_hash) if stream is not None else None
+    deadline = time.monotonic() + max_attempts * interval
+    delay = initial_delay
+    try:
+        while time.monotonic() < deadline:
+            tx = None
+            try:
+                builder = AsyncTransactionsCallBuilder(horizon_url=app_context.horizon_url, client=app_context.client).transaction(tx_hash)
+                async with app_context.confirm_semaphore:
+                    tx = await builder.call()
+            except Exception as e:
+                if "not_found" not in str(e).lower():
+                    logger.error(f"Error checking transaction {tx_hash}: {str(e)}", exc_info=True)
+                    raise
+                if streamed is not None:
+                    try:
+                        tx = await asyncio.wait_for(asyncio.shield(streamed), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(delay + random.uniform(0, 0.1))
+                delay = min(interval, delay * 1.6)
+            if tx is not None:
+                if tx.get("successful"):
+                    logger.info(f"Transaction {tx_hash} confirmed successfully")
+                    return tx
                 logger.error(f"Transaction {tx_hash} failed: {tx.get('result_codes', 'No details')}")
                 raise ValueError(f"Transaction {tx_hash} failed")
-        except Exception as e:
-            if "not_found" in str(e).lower():
-                await asyncio.sleep(interval)
-                attempts += 1
-            else:
-                logger.error(f"Error checking transaction {tx_hash}: {str(e)}", exc_info=True)
-                raise
-    raise TimeoutError(f"Transaction {tx_hash} not confirmed after {max_attempts * interval} seconds")
\ No newline at end of file
+    finally:
+        if stream is not None:
+            stream.discard(tx_hash)
+    raise TimeoutError(f"Transaction {tx_hash} not confirmed after {max_attempts * interval} seconds")
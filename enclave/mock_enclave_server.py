@@ -1,10 +1,11 @@
 import base64
-import json
+import orjson
 import logging
 import socket
 import os
+import threading
 from stellar_sdk import Keypair, Network, TransactionEnvelope
-from cryptography.fernet import Fernet
+from secret_blob import encrypt_secret, decrypt_secret
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -13,6 +14,25 @@ logger = logging.getLogger(__name__)
 # VSOCK configuration
 VSOCK_PORT = 5000
 
+# Initial per-connection receive buffer; grown when a larger request arrives
+_RECV_BUF_SIZE = 1 << 20
+
+def recv_exactly(sock, length, buf=None):
+    """Read exactly length bytes from a stream socket into buf (grown if needed); returns a memoryview.
+
+    A single recv() may return fewer bytes than requested for anything larger than one segment.
+    """
+    if buf is None or len(buf) < length:
+        buf = bytearray(length)
+    view = memoryview(buf)[:length]
+    received = 0
+    while received < length:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError(f"Connection closed after {received} of {length} bytes")
+        received += n
+    return view
+
 def decrypt_data_key(ciphertext_blob, aws_credentials):
     try:
         logger.debug(f"Requesting KMS decryption from parent for ciphertext: {ciphertext_blob[:20]}...")
@@ -29,15 +49,13 @@ def decrypt_data_key(ciphertext_blob, aws_credentials):
             "ciphertext": ciphertext_blob,
             "aws_credentials": aws_credentials
         }
-        request_data = json.dumps(request).encode('utf-8')
+        request_data = orjson.dumps(request)
         length_prefix = len(request_data).to_bytes(4, byteorder='big')
-        sock.send(length_prefix + request_data)
+        sock.sendall(length_prefix + request_data)
 
         # Receive the response
-        length_prefix = sock.recv(4)
-        length = int.from_bytes(length_prefix, byteorder='big')
-        response_data = sock.recv(length).decode('utf-8')
-        response = json.loads(response_data)
+        length = int.from_bytes(recv_exactly(sock, 4), byteorder='big')
+        response = orjson.loads(recv_exactly(sock, length))
 
         if "error" in response:
             raise ValueError(response["error"])
@@ -60,8 +78,7 @@ def generate_keypair(request):
         mnemonic_phrase = Keypair.generate_mnemonic_phrase(strength=256)
         kp = Keypair.from_mnemonic_phrase(mnemonic_phrase, index=0)
         
-        cipher = Fernet(base64.urlsafe_b64encode(data_key))
-        encrypted_secret = cipher.encrypt(kp.secret.encode()).hex()
+        encrypted_secret = encrypt_secret(data_key, kp.secret)
         
         return {
             "telegram_id": str(telegram_id),
@@ -83,9 +100,8 @@ def sign_transaction(request, aws_credentials=None):
         logger.debug(f"Signing transaction for public_key: {public_key}")
         
         kms_response = decrypt_data_key(encrypted_data_key, aws_credentials)
-        data_key = base64.urlsafe_b64encode(kms_response["Plaintext"])
-        cipher = Fernet(data_key)
-        secret = cipher.decrypt(encrypted_secret).decode()
+        data_key = kms_response["Plaintext"]
+        secret = decrypt_secret(data_key, encrypted_secret)
         
         kp = Keypair.from_secret(secret)
         if kp.public_key != public_key:
@@ -101,31 +117,38 @@ def sign_transaction(request, aws_credentials=None):
         logger.error(f"Error in sign_transaction: {str(e)}")
         return {"error": str(e)}
 
+def handle_request(request):
+    action = request.get("action")
+    if action == "generate":
+        return generate_keypair(request)
+    elif action == "sign":
+        aws_credentials = request.get("aws_credentials", {})
+        return sign_transaction(request, aws_credentials)
+    return {"error": "Unknown action"}
+
 def handle_connection(conn):
+    # The parent keeps pooled connections open, so serve framed requests until it hangs up
+    buf = bytearray(_RECV_BUF_SIZE)
     try:
-        length_prefix = conn.recv(4)
-        if len(length_prefix) != 4:
-            raise ValueError("Failed to read length prefix")
-        length = int.from_bytes(length_prefix, byteorder='big')
-        logger.debug(f"Expecting message of length: {length}")
-        
-        data = conn.recv(length).decode('utf-8')
-        request = json.loads(data)
-        logger.debug(f"Received data: {request}")
-        
-        action = request.get("action")
-        if action == "generate":
-            response = generate_keypair(request)
-        elif action == "sign":
-            aws_credentials = request.get("aws_credentials", {})
-            response = sign_transaction(request, aws_credentials)
-        else:
-            response = {"error": "Unknown action"}
-        
-        response_data = json.dumps(response).encode('utf-8')
-        length_prefix = len(response_data).to_bytes(4, byteorder='big')
-        logger.debug(f"Response length: {len(response_data)} bytes")
-        conn.send(length_prefix + response_data)
+        while True:
+            try:
+                length_prefix = recv_exactly(conn, 4)
+            except ConnectionError:
+                break
+            length = int.from_bytes(length_prefix, byteorder='big')
+            logger.debug(f"Expecting message of length: {length}")
+
+            if length > len(buf):
+                buf = bytearray(length)
+            request = orjson.loads(recv_exactly(conn, length, buf))
+            logger.debug(f"Received data: {request}")
+
+            response = handle_request(request)
+
+            response_data = orjson.dumps(response)
+            length_prefix = len(response_data).to_bytes(4, byteorder='big')
+            logger.debug(f"Response length: {len(response_data)} bytes")
+            conn.sendall(length_prefix + response_data)
     except Exception as e:
         logger.error(f"Connection error: {str(e)}")
     finally:
@@ -134,13 +157,14 @@ def handle_connection(conn):
 def main():
     sock = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
     sock.bind((socket.VMADDR_CID_ANY, VSOCK_PORT))
-    sock.listen(1)
+    sock.listen(128)
     logger.info(f"Listening on VSOCK port {VSOCK_PORT}")
     
     while True:
         conn, addr = sock.accept()
         logger.debug(f"Accepted connection from {addr}")
-        handle_connection(conn)
+        # One thread per connection: a held-open pooled connection must not block the others
+        threading.Thread(target=handle_connection, args=(conn,), daemon=True).start()
 
 if __name__ == "__main__":
     main()
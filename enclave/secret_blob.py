@@ -0,0 +1,24 @@
+# Shared by the enclave (reads and writes) and the parent's setup_fee_wallet (writes)
+import base64
+import os
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# encrypted_secret layout: version byte || 12-byte nonce || AES-256-GCM ciphertext+tag, hex-encoded.
+# Legacy rows hold hex-encoded Fernet tokens, which are base64 text that always starts with "g".
+_SECRET_BLOB_AESGCM = 0x01
+_FERNET_TOKEN_PREFIX = ord("g")
+_NONCE_SIZE = 12
+
+def encrypt_secret(data_key, secret):
+    nonce = os.urandom(_NONCE_SIZE)
+    ciphertext = AESGCM(data_key).encrypt(nonce, secret.encode(), None)
+    return (bytes((_SECRET_BLOB_AESGCM,)) + nonce + ciphertext).hex()
+
+def decrypt_secret(data_key, blob):
+    if blob[0] == _SECRET_BLOB_AESGCM:
+        nonce = blob[1:1 + _NONCE_SIZE]
+        return AESGCM(data_key).decrypt(nonce, blob[1 + _NONCE_SIZE:], None).decode()
+    if blob[0] == _FERNET_TOKEN_PREFIX:
+        return Fernet(base64.urlsafe_b64encode(data_key)).decrypt(blob).decode()
+    raise ValueError("Unknown encrypted_secret format")
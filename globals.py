@@ -1,25 +1,21 @@
 import asyncio
+from collections import defaultdict
 from dotenv import load_dotenv
 import os
-from stellar_sdk import Server
-from stellar_sdk.client.aiohttp_client import AiohttpClient
+from stellar_sdk import Server, SorobanServerAsync
+from core.stellar import PooledAiohttpClient, TransactionConfirmationStream
+from core.rate_limit import TokenBucketLimiter
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Log the current working directory and environment before loading .env
-logger.info("Current working directory: %s", os.getcwd())
-logger.info("Before load_dotenv, FEE_WALLET: %s", os.getenv("FEE_WALLET"))
-
-# Explicitly specify the path to .env and force override
+# Explicitly specify the path to .env and force override (loaded exactly once per process)
 env_path = os.path.join(os.getcwd(), ".env")
-logger.info("Attempting to load .env from: %s", env_path)
 load_dotenv(env_path, override=True)  # Force override of existing environment variables
 
-# Log the environment after loading .env
-logger.info("After load_dotenv, FEE_WALLET: %s", os.getenv("FEE_WALLET"))
+if logger.isEnabledFor(logging.DEBUG):
+    logger.debug("Loaded .env from %s, FEE_WALLET: %s", env_path, os.getenv("FEE_WALLET"))
 
-load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 if not TELEGRAM_TOKEN:
     raise ValueError("TELEGRAM_TOKEN not found in .env")
@@ -34,23 +30,55 @@ class AppContext:
         self.generate_keypair = None  # New
         self.sign_transaction = None  # New
         self.load_public_key = None   # Keep for public key access
+        self.load_signing_user = None  # telegram_id -> row with public_key + encrypted key material
         self.dp = None
         self.tasks = []
         self.queue = queue
         self.horizon_url = "https://horizon.stellar.org"
-        self.client = AiohttpClient()
+        self.rate_limiter = TokenBucketLimiter(
+            rate=float(os.getenv("HORIZON_RATE_LIMIT", "10")),
+            max_concurrency=int(os.getenv("HORIZON_MAX_CONCURRENCY", "32"))
+        )
+        self.client = PooledAiohttpClient(rate_limiter=self.rate_limiter)  # Shared keep-alive pool for all Horizon calls
         self.server = Server(self.horizon_url, client=self.client)
+        self.soroban_rpc_url = "https://mainnet.sorobanrpc.com"  # Free mainnet RPC endpoint
+        self.soroban_client = PooledAiohttpClient()  # Shared keep-alive pool for Soroban RPC calls
+        self.soroban_server = SorobanServerAsync(self.soroban_rpc_url, client=self.soroban_client)
         self.base_fee = 300  # Default base fee in stroops
+        self.fee_cache = (0.0, None)  # (monotonic timestamp, recommended fee)
+        self.fee_lock = asyncio.Lock()
+        self.sequence_cache = {}  # public_key -> next sequence to build from
+        self.sequence_locks = defaultdict(asyncio.Lock)
+        self.account_cache = {}  # public_key -> (monotonic timestamp, account dict) for display paths
+        self.confirmation_stream = TransactionConfirmationStream(self)
+        self.confirm_semaphore = asyncio.Semaphore(int(os.getenv("HORIZON_CONFIRM_CONCURRENCY", "20")))  # Caps concurrent confirmation polls
         
 
     async def shutdown(self):
         self.shutdown_flag.set()
         if self.tasks:
             await asyncio.gather(*self.tasks, return_exceptions=True)
-        if self.db_pool_nitro:
-            await self.db_pool_nitro.close()
-        if self.db_pool_copytrading:
-            await self.db_pool_copytrading.close()
-        if self.client:
-            await self.client.close()  # Close the shared client
+        # Detach each resource before closing it so a second shutdown (e.g. a repeated signal) is a no-op
+        db_pool_nitro, self.db_pool_nitro = self.db_pool_nitro, None
+        if db_pool_nitro:
+            await db_pool_nitro.close()
+        db_pool_copytrading, self.db_pool_copytrading = self.db_pool_copytrading, None
+        if db_pool_copytrading:
+            await db_pool_copytrading.close()
+        await self.confirmation_stream.close()
+        client, self.client = self.client, None
+        if client:
+            # self.server shares this client, so this closes the only Horizon connection pool
+            try:
+                async with client:
+                    pass
+            except Exception:
+                logger.exception("Failed to close Horizon client")
+        soroban_client, self.soroban_client = self.soroban_client, None
+        if soroban_client:
+            try:
+                async with soroban_client:
+                    pass
+            except Exception:
+                logger.exception("Failed to close Soroban RPC client")
         print("Shutdown complete.")
\ No newline at end of file
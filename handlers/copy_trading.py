@@ -5,7 +5,7 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 import asyncio
 import logging
-from stellar_sdk import Keypair
+from stellar_sdk.strkey import StrKey
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -81,10 +81,8 @@ async def process_wallet_address(message: types.Message, state: FSMContext, stre
     telegram_id = message.from_user.id
     
     # Validate the wallet address as a Stellar public key
-    try:
-        Keypair.from_public_key(wallet_address)
-    except Exception as e:
-        await message.reply(f"Invalid Stellar public key: {str(e)}")
+    if not StrKey.is_valid_ed25519_public_key(wallet_address):
+        await message.reply("Invalid Stellar public key.")
         return
     
     try:
@@ -1,22 +1,28 @@
 import logging
-from aiogram import types
+from aiogram import F, types
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import Command
-from core.stellar import build_and_submit_transaction, has_trustline, parse_asset, load_account_async
-from stellar_sdk import Asset, PathPaymentStrictReceive, ChangeTrust, Payment, Keypair
+from aiogram.filters import Command, StateFilter
+from aiogram.filters.callback_data import CallbackData
+from core.stellar import build_and_submit_transaction, has_trustline, build_trustline_index, parse_asset, load_account_cached
+from stellar_sdk import Asset, PathPaymentStrictReceive, ChangeTrust, Payment
 from stellar_sdk.exceptions import NotFoundError
+from stellar_sdk.strkey import StrKey
 from handlers.copy_trading import copy_trade_menu_command
 from services.streaming import StreamingService
-from services.trade_services import perform_buy, perform_sell
-from services.referrals import log_xlm_volume, calculate_referral_shares, export_unpaid_rewards, daily_payout
+from services.trade_services import perform_buy, perform_sell, perform_withdraw, perform_add_trustline, perform_remove_trustline
+from services.referrals import log_xlm_volume, calculate_referral_shares, export_unpaid_rewards, daily_payout, REFERRER_QUERY
 import secrets
 import os
+import re
 import asyncio
+import heapq
+import time
+from collections import OrderedDict
 from datetime import datetime
+from decimal import Decimal
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 class BuySellStates(StatesGroup):
@@ -36,6 +42,17 @@ class TrustlineStates(StatesGroup):
     waiting_for_asset_to_add = State()
     waiting_for_asset_to_remove = State()
 
+class SeedSavedCallback(CallbackData, prefix="seed_saved"):
+    telegram_id: int
+
+class UnregisterCallback(CallbackData, prefix="unregister"):
+    action: str  # "confirm" or "cancel"
+    telegram_id: int
+
+# Read once; globals loads .env before this module is imported. Unset means nobody is admin.
+_admin_id = os.getenv("ADMIN_TELEGRAM_ID", "")
+ADMIN_TELEGRAM_ID = int(_admin_id) if _admin_id.isdigit() else None
+
 welcome_text = """
 Welcome to @Stellar_Photon_bot!
 Trade assets on Stellar with ease.
@@ -54,63 +71,139 @@ main_menu_keyboard = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="Help/FAQ", callback_data="help_faq")]
 ])
 
+# Static welcome reply shown after every finished flow; built once and splatted into reply()
+_WELCOME_KWARGS = {"text": welcome_text, "reply_markup": main_menu_keyboard, "parse_mode": "Markdown"}
+
+_BACKUP_TEMPLATE = (
+    "Registered! Your public key: `{public_key}`\n\n"
+    "**Your Recovery Mnemonic (SAVE THIS NOW):**\n"
+    "`{recovery_secret}`\n\n"
+    "**WARNING**: This is the *ONLY TIME* you will see this mnemonic. "
+    "Write it down or store it securely offline (e.g., paper, USB). "
+    "If you lose it, you will lose access to your wallet and funds. "
+    "Delete this message after saving it!\n\n"
+    "DO NOT screenshot or share it—your device or Telegram could be compromised. "
+    "**Bot Wallet**: This wallet is for trading with @Stellar_Photon_bot. "
+    "Fund it with only the XLM you plan to trade to keep your other wallets safe.\n\n"
+    "**Recovery**: To recover your wallet, import the 24-word mnemonic into a Stellar wallet "
+    "like Xbull, Lobstr, or any wallet supporting 24-word Stellar mnemonics.\n\n"
+    "Click the button below to confirm you’ve saved it."
+)
+
+def _build_backup_message(public_key, recovery_secret, telegram_id):
+    """Return the one-time mnemonic backup text and its "I've Saved It" keyboard."""
+    text = _BACKUP_TEMPLATE.format_map({"public_key": public_key, "recovery_secret": recovery_secret})
+    markup = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="I’ve Saved It", callback_data=SeedSavedCallback(telegram_id=telegram_id).pack())]
+    ])
+    return text, markup
+
+async def _insert_copytrading_user(app_context, telegram_id, public_key, referral_code):
+    """Insert the user and, if referral_code resolves, their referral row in one round trip.
+
+    Returns the referrer's telegram_id, or None when referral_code is empty or unknown.
+    """
+    referrer_id = await app_context.db_pool_copytrading.fetchval(
+        """
+        WITH r AS (SELECT telegram_id AS rid FROM users WHERE referral_code = $4),
+             ins_u AS (INSERT INTO users (telegram_id, referral_code, public_key) VALUES ($1, $2, $3)),
+             ins_r AS (INSERT INTO referrals (referee_id, referrer_id) SELECT $1, rid FROM r)
+        SELECT rid FROM r
+        """,
+        telegram_id, secrets.token_urlsafe(8), public_key, referral_code
+    )
+    if referrer_id:
+        logger.info(f"Found referrer {referrer_id} for referral_code {referral_code}")
+    elif referral_code:
+        logger.warning(f"No referrer found for referral_code {referral_code}")
+    return referrer_id
+
+_WELCOME_FUNDED = (
+    "*Welcome to @Stellar_Photon_bot!*\n"
+    "Jump into Stellar trading with ease!\n\n"
+    "*Your Wallet:* `{public_key}`\n"
+    "*XLM Balance:* {xlm_balance:.7f}\n\n"
+    "Trade issued assets and Soroban SAC, stream copy trade wallets, and earn rewards with referrals.\n"
+    "Use the buttons below to get started.\n\n"
+    "*New Users* Fund your wallet with XLM to trade. See /help for wallet and security tips.\n"
+    "*Note:* Soroban supported for copy trades!"
+)
+
+_WELCOME_UNFUNDED = (
+    "*Welcome to @Stellar_Photon_bot!*\n"
+    "Jump into Stellar trading with ease!\n\n"
+    "*Your Wallet:* `{public_key}`\n"
+    "*XLM Balance:* Not funded\n\n"
+    "Your wallet needs XLM to start trading. Send XLM to your public key from an exchange "
+    "(e.g., Coinbase, Kraken, Lobstr).\n\n"
+    "Trade issued assets and Soroban SAC, stream copy trade wallets, and earn rewards with referrals.\n"
+    "Use the buttons below to get started. See /help for wallet and security tips.\n"
+    "*Note:* Soroban supported for copy trades!"
+)
+
+_WELCOME_GENERIC = (
+    "*Welcome to @Stellar_Photon_bot!*\n"
+    "Jump into Stellar trading with ease!\n\n"
+    "Trade issued assets and Soroban SAC, stream copy trade wallets, and earn rewards with referrals.\n"
+    "Use the buttons below to get started.\n\n"
+    "*New Users* Fund your wallet with XLM to trade. See /help for wallet and security tips.\n"
+    "*Note:* Soroban supported for copy trades!"
+)
+
 async def generate_welcome_message(telegram_id, app_context):
     try:
         public_key = await app_context.load_public_key(telegram_id)
         try:
-            account = await load_account_async(public_key, app_context)
-            xlm_balance = float(next((b["balance"] for b in account["balances"] if b["asset_type"] == "native"), "0"))
-            welcome_text = (
-                f"*Welcome to @Stellar_Photon_bot!*\n"
-                f"Jump into Stellar trading with ease!\n\n"
-                f"*Your Wallet:* `{public_key}`\n"
-                f"*XLM Balance:* {xlm_balance:.7f}\n\n"
-                f"Trade issued assets and Soroban SAC, stream copy trade wallets, and earn rewards with referrals.\n"
-                f"Use the buttons below to get started.\n\n"
-                f"*New Users* Fund your wallet with XLM to trade. See /help for wallet and security tips.\n"
-                f"*Note:* Soroban supported for copy trades!"
-            )
+            account = await load_account_cached(public_key, app_context)
+            native = build_trustline_index(account).get(("native", None))
+            xlm_balance = float(native["balance"]) if native else 0.0
+            return _WELCOME_FUNDED.format_map({"public_key": public_key, "xlm_balance": xlm_balance})
         except NotFoundError:
-            welcome_text = (
-                f"*Welcome to @Stellar_Photon_bot!*\n"
-                f"Jump into Stellar trading with ease!\n\n"
-                f"*Your Wallet:* `{public_key}`\n"
-                f"*XLM Balance:* Not funded\n\n"
-                f"Your wallet needs XLM to start trading. Send XLM to your public key from an exchange "
-                f"(e.g., Coinbase, Kraken, Lobstr).\n\n"
-                f"Trade issued assets and Soroban SAC, stream copy trade wallets, and earn rewards with referrals.\n"
-                f"Use the buttons below to get started. See /help for wallet and security tips.\n"
-                f"*Note:* Soroban supported for copy trades!"
-            )
+            return _WELCOME_UNFUNDED.format_map({"public_key": public_key})
     except Exception as e:
         logger.error(f"Error fetching wallet info for welcome message: {str(e)}", exc_info=True)
-        welcome_text = (
-            f"*Welcome to @Stellar_Photon_bot!*\n"
-            f"Jump into Stellar trading with ease!\n\n"
-            f"Trade issued assets and Soroban SAC, stream copy trade wallets, and earn rewards with referrals.\n"
-            f"Use the buttons below to get started.\n\n"
-            f"*New Users* Fund your wallet with XLM to trade. See /help for wallet and security tips.\n"
-            f"*Note:* Soroban supported for copy trades!"
-        )
-    return welcome_text
+        return _WELCOME_GENERIC
+
+# "code:issuer" with a 1-12 character alphanumeric asset code and a G... StrKey-alphabet issuer
+_ASSET_RE = re.compile(r"([A-Za-z0-9]{1,12}):(G[A-Z2-7]{55})")
+
+_AMOUNT_RE = re.compile(r"\d+(\.\d{1,7})?")
+
+# Telegram ids known to have a nitro wallet; only positive lookups are cached, so a
+# registration is picked up immediately and unregister removes the entry. LRU-bounded.
+_registered_users = OrderedDict()
+REGISTERED_USERS_CACHE_SIZE = 10_000
+
+def _remember_registered(telegram_id):
+    _registered_users[telegram_id] = True
+    _registered_users.move_to_end(telegram_id)
+    if len(_registered_users) > REGISTERED_USERS_CACHE_SIZE:
+        _registered_users.popitem(last=False)
+
+async def _is_registered(app_context, telegram_id):
+    if telegram_id in _registered_users:
+        _registered_users.move_to_end(telegram_id)
+        return True
+    exists = await app_context.db_pool_nitro.fetchval("SELECT telegram_id FROM users WHERE telegram_id = $1", telegram_id)
+    if exists:
+        _remember_registered(telegram_id)
+    return bool(exists)
+
+# Deep-link payload: "/start ref-<code>" (also "/start@botname ...")
+_START_REF_RE = re.compile(r"\s*/start\S*\s+.*?ref-(\S+)")
 
 async def start_command(message: types.Message, app_context, streaming_service: StreamingService, state: FSMContext):
     telegram_id = message.from_user.id
-    logger.info(f"Start command: from_user.id={telegram_id}, chat_id={message.chat.id}, is_group={message.chat.type == 'group'}")
+    logger.info("Start command: from_user.id=%s, chat_id=%s, chat_type=%s", telegram_id, message.chat.id, message.chat.type)
     chat_id = message.chat.id
     
-    text = message.text.strip()
-    if text.startswith('/start'):
-        parts = text.split(maxsplit=1)
-        if len(parts) > 1:
-            args = parts[1]
-            if 'ref-' in args:
-                referral_code = args.split('ref-')[1]
-                await state.update_data(referral_code=referral_code)
-                logger.info(f"Stored referral code {referral_code} in state for user {telegram_id}")
+    match = _START_REF_RE.match(message.text or "")
+    if match:
+        referral_code = match.group(1)
+        await state.update_data(referral_code=referral_code)
+        logger.info("Stored referral code %s in state for user %s", referral_code, telegram_id)
     
-    async with app_context.db_pool_nitro.acquire() as conn:
-        exists = await conn.fetchval("SELECT telegram_id FROM users WHERE telegram_id = $1", telegram_id)
+    exists = await _is_registered(app_context, telegram_id)
     if not exists and message.from_user.is_bot:
         logger.info(f"Ignoring start command from bot itself for telegram_id {telegram_id}")
         return
@@ -126,36 +219,25 @@ async def cancel_command(message: types.Message, state: FSMContext):
 
 async def register_command(message: types.Message, app_context, state: FSMContext):
     telegram_id = message.from_user.id
-    logger.info(f"Register command: from_user.id={telegram_id}, chat_id={message.chat.id}, is_group={message.chat.type == 'group'}")
+    logger.info("Register command: from_user.id=%s, chat_id=%s, chat_type=%s", telegram_id, message.chat.id, message.chat.type)
     chat_id = message.chat.id
     
-    async with app_context.db_pool_nitro.acquire() as conn:
-        exists = await conn.fetchval("SELECT telegram_id FROM users WHERE telegram_id = $1", telegram_id)
-        if exists:
-            await message.reply("You’re already registered!")
-            return
+    exists = await _is_registered(app_context, telegram_id)
+    if exists:
+        await message.reply("You’re already registered!")
+        return
     
     data = await state.get_data()
     referral_code = data.get('referral_code')
-    logger.info(f"Referral code retrieved from state: {referral_code}")
+    logger.debug("Referral code retrieved from state: %s", referral_code)
     
     if not referral_code:
         await message.reply("Do you have a referral code? If yes, please enter it now (e.g., dPVDzjTUaWM). If not, reply with 'none'.")
         await state.set_state(ReferralStates.referral_code)
         return
     
-    referrer_id = None
-    if referral_code and referral_code.lower() != 'none':
-        async with app_context.db_pool_copytrading.acquire() as conn:
-            referrer_id = await conn.fetchval(
-                "SELECT telegram_id FROM users WHERE referral_code = $1",
-                referral_code
-            )
-        if referrer_id:
-            logger.info(f"Found referrer {referrer_id} for referral_code {referral_code}")
-        else:
-            logger.warning(f"No referrer found for referral code {referral_code}")
-            await message.reply("Invalid referral code. Proceeding without a referrer.")
+    if referral_code.lower() == 'none':
+        referral_code = None
     
     bot_id = app_context.bot.id
     if telegram_id == bot_id:
@@ -165,41 +247,17 @@ async def register_command(message: types.Message, app_context, state: FSMContex
     
     try:
         response = await app_context.generate_keypair(telegram_id)
+        _remember_registered(telegram_id)
         public_key = response["public_key"]
         recovery_secret = response["recovery_secret"]
         
-        referral_code_value = secrets.token_urlsafe(8)
-        async with app_context.db_pool_copytrading.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO users (telegram_id, referral_code, public_key) VALUES ($1, $2, $3)",
-                telegram_id, referral_code_value, public_key
-            )
-            if referrer_id:
-                await conn.execute(
-                    "INSERT INTO referrals (referee_id, referrer_id) VALUES ($1, $2)",
-                    telegram_id, referrer_id
-                )
+        referrer_id = await _insert_copytrading_user(app_context, telegram_id, public_key, referral_code)
+        if referral_code and not referrer_id:
+            await message.reply("Invalid referral code. Proceeding without a referrer.")
         
         await state.clear()
         
-        backup_message = (
-            f"Registered! Your public key: `{public_key}`\n\n"
-            f"**Your Recovery Mnemonic (SAVE THIS NOW):**\n"
-            f"`{recovery_secret}`\n\n"
-            f"**WARNING**: This is the *ONLY TIME* you will see this mnemonic. "
-            f"Write it down or store it securely offline (e.g., paper, USB). "
-            f"If you lose it, you will lose access to your wallet and funds. "
-            f"Delete this message after saving it!\n\n"
-            f"DO NOT screenshot or share it—your device or Telegram could be compromised. "
-            f"**Bot Wallet**: This wallet is for trading with @Stellar_Photon_bot. "
-            f"Fund it with only the XLM you plan to trade to keep your other wallets safe.\n\n"
-            f"**Recovery**: To recover your wallet, import the 24-word mnemonic into a Stellar wallet "
-            f"like Xbull, Lobstr, or any wallet supporting 24-word Stellar mnemonics.\n\n"
-            f"Click the button below to confirm you’ve saved it."
-        )
-        confirmation_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="I’ve Saved It", callback_data=f"seed_saved_{telegram_id}")]
-        ])
+        backup_message, confirmation_keyboard = _build_backup_message(public_key, recovery_secret, telegram_id)
         await message.reply(backup_message, parse_mode="Markdown", reply_markup=confirmation_keyboard)
         logger.info("Registration message sent successfully")
     except Exception as e:
@@ -214,19 +272,6 @@ async def process_referral_code(message: types.Message, state: FSMContext, app_c
     if referral_code.lower() == 'none':
         referral_code = None
     
-    referrer_id = None
-    if referral_code:
-        async with app_context.db_pool_copytrading.acquire() as conn:
-            referrer_id = await conn.fetchval(
-                "SELECT telegram_id FROM users WHERE referral_code = $1",
-                referral_code
-            )
-        if referrer_id:
-            logger.info(f"Found referrer {referrer_id} for referral_code {referral_code}")
-        else:
-            logger.warning(f"No referrer found for referral_code {referral_code}")
-            await message.reply("Invalid referral code. Proceeding without a referrer.")
-    
     bot_id = app_context.bot.id
     if telegram_id == bot_id:
         logger.error(f"Attempted registration with bot ID {telegram_id}, rejecting")
@@ -236,41 +281,17 @@ async def process_referral_code(message: types.Message, state: FSMContext, app_c
     
     try:
         response = await app_context.generate_keypair(telegram_id)
+        _remember_registered(telegram_id)
         public_key = response["public_key"]
         recovery_secret = response["recovery_secret"]
         
-        referral_code_value = secrets.token_urlsafe(8)
-        async with app_context.db_pool_copytrading.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO users (telegram_id, referral_code, public_key) VALUES ($1, $2, $3)",
-                telegram_id, referral_code_value, public_key
-            )
-            if referrer_id:
-                await conn.execute(
-                    "INSERT INTO referrals (referee_id, referrer_id) VALUES ($1, $2)",
-                    telegram_id, referrer_id
-                )
+        referrer_id = await _insert_copytrading_user(app_context, telegram_id, public_key, referral_code)
+        if referral_code and not referrer_id:
+            await message.reply("Invalid referral code. Proceeding without a referrer.")
         
         await state.clear()
         
-        backup_message = (
-            f"Registered! Your public key: `{public_key}`\n\n"
-            f"**Your Recovery Mnemonic (SAVE THIS NOW):**\n"
-            f"`{recovery_secret}`\n\n"
-            f"**WARNING**: This is the *ONLY TIME* you will see this mnemonic. "
-            f"Write it down or store it securely offline (e.g., paper, USB). "
-            f"If you lose it, you will lose access to your wallet and funds. "
-            f"Delete this message after saving it!\n\n"
-            f"DO NOT screenshot or share it—your device or Telegram could be compromised. "
-            f"**Bot Wallet**: This wallet is for trading with @Stellar_Photon_bot. "
-            f"Fund it with only the XLM you plan to trade to keep your other wallets safe.\n\n"
-            f"**Recovery**: To recover your wallet, import the 24-word mnemonic into a Stellar wallet "
-            f"like Xbull, Lobstr, or any wallet supporting 24-word Stellar mnemonics.\n\n"
-            f"Click the button below to confirm you’ve saved it."
-        )
-        confirmation_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="I’ve Saved It", callback_data=f"seed_saved_{telegram_id}")]
-        ])
+        backup_message, confirmation_keyboard = _build_backup_message(public_key, recovery_secret, telegram_id)
         await message.reply(backup_message, parse_mode="Markdown", reply_markup=confirmation_keyboard)
         logger.info("Registration message sent successfully")
     except Exception as e:
@@ -278,24 +299,56 @@ async def process_referral_code(message: types.Message, state: FSMContext, app_c
         await message.reply(f"Registration failed: {str(e)}")
         await state.clear()
 
-async def confirm_seed_saved(callback: types.CallbackQuery, app_context):
+async def confirm_seed_saved(callback: types.CallbackQuery, callback_data: SeedSavedCallback, app_context):
     telegram_id = callback.from_user.id
-    logger.info(f"Received callback: {callback.data}")
+    logger.debug("Received callback: %s", callback.data)
     try:
-        if f"seed_saved_{telegram_id}" in callback.data:
+        if callback_data.telegram_id == telegram_id:
             logger.info(f"Confirmed seed saved for user {telegram_id}")
             await callback.message.delete()
             await callback.message.answer(
                 "Great! The Message with your secret seed has been deleted, and your wallet is ready. Use /start to begin trading.",
                 parse_mode="Markdown"
             )
-            asyncio.create_task(send_reminder(callback.message.bot, telegram_id))
+            schedule_reminder(callback.message.bot, telegram_id)
     except Exception as e:
         logger.error(f"Error in confirm_seed_saved: {str(e)}", exc_info=True)
     await callback.answer()
 
+# Pending seed reminders as a (due monotonic time, telegram_id) heap, drained by one shared task
+# instead of a sleeping task per registration
+REMINDER_DELAY = 30
+_reminders = []
+_reminder_wakeup = None
+_reminder_task = None
+
+def schedule_reminder(bot, telegram_id, delay=REMINDER_DELAY):
+    global _reminder_wakeup, _reminder_task
+    heapq.heappush(_reminders, (time.monotonic() + delay, telegram_id))
+    if _reminder_task is None or _reminder_task.done():
+        _reminder_wakeup = asyncio.Event()
+        _reminder_task = asyncio.create_task(_reminder_loop(bot))
+    _reminder_wakeup.set()
+
+async def _reminder_loop(bot):
+    while True:
+        if not _reminders:
+            await _reminder_wakeup.wait()
+            _reminder_wakeup.clear()
+            continue
+        delay = _reminders[0][0] - time.monotonic()
+        if delay > 0:
+            # Wake early if a new reminder is pushed; re-check the heap top either way
+            try:
+                await asyncio.wait_for(_reminder_wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            _reminder_wakeup.clear()
+            continue
+        _, telegram_id = heapq.heappop(_reminders)
+        await send_reminder(bot, telegram_id)
+
 async def send_reminder(bot, telegram_id):
-    await asyncio.sleep(30)
     try:
         await bot.send_message(telegram_id, "Reminder: Ensure your seed is securely stored offline!")
         logger.info(f"Sent reminder to user {telegram_id}")
@@ -304,83 +357,54 @@ async def send_reminder(bot, telegram_id):
 
 async def unregister_command(message: types.Message, app_context, streaming_service: StreamingService):
     telegram_id = message.from_user.id
-    logger.info(f"Unregister command: from_user.id={telegram_id}, chat_id={message.chat.id}, is_group={message.chat.type == 'group'}")
+    logger.info("Unregister command: from_user.id=%s, chat_id=%s, chat_type=%s", telegram_id, message.chat.id, message.chat.type)
     chat_id = message.chat.id
-    async with app_context.db_pool_nitro.acquire() as conn:
-        existing = await conn.fetchval("SELECT telegram_id FROM users WHERE telegram_id = $1", telegram_id)
-        if not existing:
-            await message.reply("No wallet registered.")
-            return
-        warning_message = (
-            "Warning: Unregistering will delete your wallet keypair and associated data. "
-            "Since backups are only provided during registration, ensure you’ve saved your recovery secret elsewhere if you have funds.\n\n"
-            "Are you sure you want to proceed?"
-        )
-        confirm_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Yes, Unregister", callback_data=f"confirm_unregister_{telegram_id}"),
-             InlineKeyboardButton(text="No, Cancel", callback_data=f"cancel_unregister_{telegram_id}")]
-        ])
-        await message.reply(warning_message, reply_markup=confirm_keyboard)
-
-async def confirm_unregister(callback: types.CallbackQuery, app_context, streaming_service: StreamingService):
+    existing = await app_context.db_pool_nitro.fetchval("SELECT telegram_id FROM users WHERE telegram_id = $1", telegram_id)
+    if not existing:
+        await message.reply("No wallet registered.")
+        return
+    warning_message = (
+        "Warning: Unregistering will delete your wallet keypair and associated data. "
+        "Since backups are only provided during registration, ensure you’ve saved your recovery secret elsewhere if you have funds.\n\n"
+        "Are you sure you want to proceed?"
+    )
+    confirm_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Yes, Unregister", callback_data=UnregisterCallback(action="confirm", telegram_id=telegram_id).pack()),
+         InlineKeyboardButton(text="No, Cancel", callback_data=UnregisterCallback(action="cancel", telegram_id=telegram_id).pack())]
+    ])
+    await message.reply(warning_message, reply_markup=confirm_keyboard)
+
+async def confirm_unregister(callback: types.CallbackQuery, callback_data: UnregisterCallback, app_context, streaming_service: StreamingService):
     telegram_id = callback.from_user.id
     chat_id = callback.message.chat.id
-    logger.info(f"Confirm unregister: telegram_id={telegram_id}, chat_id={chat_id}")
+    logger.info("Confirm unregister: telegram_id=%s, chat_id=%s", telegram_id, chat_id)
     try:
-        if f"confirm_unregister_{telegram_id}" in callback.data:
+        if callback_data.telegram_id != telegram_id:
+            logger.warning(f"Ignoring unregister callback for {callback_data.telegram_id} from user {telegram_id}")
+        elif callback_data.action == "confirm":
             logger.info(f"Proceeding with unregister for user {telegram_id}")
-            async with app_context.db_pool_nitro.acquire() as conn:
-                await conn.execute("DELETE FROM users WHERE telegram_id = $1", telegram_id)
-                result = await conn.fetchval("SELECT telegram_id FROM users WHERE telegram_id = $1", telegram_id)
-                if result:
-                    logger.error(f"Deletion failed: User {telegram_id} still exists in NITRO database")
-                else:
-                    logger.info(f"User {telegram_id} successfully deleted from NITRO database")
-
-            async with app_context.db_pool_copytrading.acquire() as conn:
-                await conn.execute("DELETE FROM trades WHERE user_id = $1", telegram_id)
-                result = await conn.fetchval("SELECT user_id FROM trades WHERE user_id = $1", telegram_id)
-                if result:
-                    logger.error(f"Deletion failed: User {telegram_id} still exists in Copy Trading trades table")
-                else:
-                    logger.info(f"User {telegram_id} successfully deleted from Copy Trading trades table")
-
-                await conn.execute("DELETE FROM rewards WHERE user_id = $1", telegram_id)
-                result = await conn.fetchval("SELECT user_id FROM rewards WHERE user_id = $1", telegram_id)
-                if result:
-                    logger.error(f"Deletion failed: User {telegram_id} still exists in Copy Trading rewards table")
-                else:
-                    logger.info(f"User {telegram_id} successfully deleted from Copy Trading rewards table")
-
-                await conn.execute("DELETE FROM copy_trading WHERE user_id = $1", telegram_id)
-                result = await conn.fetchval("SELECT user_id FROM copy_trading WHERE user_id = $1", telegram_id)
-                if result:
-                    logger.error(f"Deletion failed: User {telegram_id} still exists in Copy Trading copy_trading table")
-                else:
-                    logger.info(f"User {telegram_id} successfully deleted from Copy Trading copy_trading table")
-
-                await conn.execute("DELETE FROM referrals WHERE referee_id = $1 OR referrer_id = $1", telegram_id)
-                result = await conn.fetchval("SELECT referee_id FROM referrals WHERE referee_id = $1", telegram_id)
-                if result:
-                    logger.error(f"Deletion failed: User {telegram_id} still exists in Copy Trading referrals table as referee")
-                else:
-                    logger.info(f"User {telegram_id} successfully deleted from Copy Trading referrals table as referee")
-                result = await conn.fetchval("SELECT referrer_id FROM referrals WHERE referrer_id = $1", telegram_id)
-                if result:
-                    logger.error(f"Deletion failed: User {telegram_id} still exists in Copy Trading referrals table as referrer")
-                else:
-                    logger.info(f"User {telegram_id} successfully deleted from Copy Trading referrals table as referrer")
-
-                await conn.execute("DELETE FROM users WHERE telegram_id = $1", telegram_id)
-                result = await conn.fetchval("SELECT telegram_id FROM users WHERE telegram_id = $1", telegram_id)
-                if result:
-                    logger.error(f"Deletion failed: User {telegram_id} still exists in Copy Trading users table")
-                else:
-                    logger.info(f"User {telegram_id} successfully deleted from Copy Trading users table")
+            await app_context.db_pool_nitro.execute("DELETE FROM users WHERE telegram_id = $1", telegram_id)
+            logger.info(f"User {telegram_id} deleted from NITRO database")
+
+            # One round trip: asyncpg can't bind parameters in a multi-statement query, so the
+            # per-table deletes are chained as data-modifying CTEs in a single statement
+            await app_context.db_pool_copytrading.execute(
+                """
+                WITH del_trades AS (DELETE FROM trades WHERE user_id = $1),
+                     del_rewards AS (DELETE FROM rewards WHERE user_id = $1),
+                     del_copy_trading AS (DELETE FROM copy_trading WHERE user_id = $1),
+                     del_referrals AS (DELETE FROM referrals WHERE referee_id = $1 OR referrer_id = $1)
+                DELETE FROM users WHERE telegram_id = $1
+                """,
+                telegram_id
+            )
+            logger.info(f"User {telegram_id} deleted from Copy Trading database")
+            _referrer_cache.pop(telegram_id, None)
+            _registered_users.pop(telegram_id, None)
 
             await streaming_service.stop_streaming(chat_id)
             await callback.message.edit_text("Unregistered successfully. To re-register, use /start.")
-        elif f"cancel_unregister_{telegram_id}" in callback.data:
+        elif callback_data.action == "cancel":
             await callback.message.edit_text("Unregistration cancelled. Your wallet remains active.")
     except Exception as e:
         logger.error(f"Error in confirm_unregister: {str(e)}", exc_info=True)
@@ -388,7 +412,7 @@ async def confirm_unregister(callback: types.CallbackQuery, app_context, streami
     await callback.answer()
 
 async def process_buy_sell(callback: types.CallbackQuery, state: FSMContext):
-    logger.info(f"Processing buy/sell callback: {callback.data}")
+    logger.debug("Processing buy/sell callback: %s", callback.data)
     action = callback.data
     await state.update_data(action=action)
     await callback.message.reply(f"Please enter the asset code and issuer for {action} in the format: code:issuer")
@@ -397,16 +421,32 @@ async def process_buy_sell(callback: types.CallbackQuery, state: FSMContext):
 
 async def process_asset(message: types.Message, state: FSMContext):
     asset_input = message.text.strip()
-    try:
-        code, issuer = asset_input.split(':')
-        if not issuer.startswith('G') or len(issuer) != 56:
-            raise ValueError("Issuer must be a valid Stellar public key")
-        await state.update_data(asset_code=code, asset_issuer=issuer)
-        await message.reply("Enter the amount to buy/sell:")
-        await state.set_state(BuySellStates.waiting_for_amount)
-    except ValueError as e:
-        logger.error(f"Invalid asset format: {str(e)}", exc_info=True)
-        await message.reply(f"Invalid format: {str(e)}. Use: code:issuer")
+    match = _ASSET_RE.fullmatch(asset_input)
+    if not match:
+        logger.info(f"Invalid asset format: {asset_input}")
+        await message.reply("Invalid format. Use: code:issuer, with a 1-12 character code and a Stellar public key issuer")
+        return
+    code, issuer = match.groups()
+    await state.update_data(asset_code=code, asset_issuer=issuer)
+    await message.reply("Enter the amount to buy/sell:")
+    await state.set_state(BuySellStates.waiting_for_amount)
+
+# telegram_id -> (has_referrer, monotonic timestamp); referrals are set at registration and rarely change.
+# LRU-bounded so inactive traders age out.
+_referrer_cache = OrderedDict()
+REFERRER_CACHE_TTL = 3600
+REFERRER_CACHE_SIZE = 10_000
+
+async def _has_referrer(app_context, telegram_id):
+    cached = _referrer_cache.get(telegram_id)
+    if cached is not None and time.monotonic() - cached[1] < REFERRER_CACHE_TTL:
+        return cached[0]
+    has_referrer = await app_context.db_pool_copytrading.fetchval(REFERRER_QUERY, telegram_id) is not None
+    _referrer_cache[telegram_id] = (has_referrer, time.monotonic())
+    _referrer_cache.move_to_end(telegram_id)
+    if len(_referrer_cache) > REFERRER_CACHE_SIZE:
+        _referrer_cache.popitem(last=False)
+    return has_referrer
 
 async def process_amount(message: types.Message, state: FSMContext, app_context):
     try:
@@ -422,26 +462,26 @@ async def process_amount(message: types.Message, state: FSMContext, app_context)
             response, actual_xlm_spent, actual_amount_received = await perform_buy(
                 message.from_user.id, app_context.db_pool_nitro, asset_code, asset_issuer, amount, app_context
             )
-            await log_xlm_volume(message.from_user.id, actual_xlm_spent, response['hash'], app_context.db_pool_copytrading)
-            async with app_context.db_pool_copytrading.acquire() as conn:
-                has_referrer = await conn.fetchval(
-                    "SELECT referrer_id FROM referrals WHERE referee_id = $1", message.from_user.id
-                )
+            # Independent round trips; referral shares below read the logged volume, so they wait for both
+            _, has_referrer = await asyncio.gather(
+                log_xlm_volume(message.from_user.id, actual_xlm_spent, response['hash'], app_context.db_pool_copytrading),
+                _has_referrer(app_context, message.from_user.id)
+            )
             fee = actual_xlm_spent * (0.009 if has_referrer else 0.01)
-            logger.info(f"Calculated fee for user {message.from_user.id}: {fee:.7f} XLM (has_referrer: {has_referrer})")
+            logger.info("Calculated fee for user %s: %.7f XLM (has_referrer: %s)", message.from_user.id, fee, has_referrer)
             await calculate_referral_shares(app_context.db_pool_copytrading, message.from_user.id, fee)
             await message.reply(f"Buy successful. Bought {actual_amount_received:.7f} {asset_code} for {actual_xlm_spent:.7f} XLM\nTx Hash: {response['hash']}")
         elif action == 'sell':
             response, actual_xlm_received, actual_amount_sent = await perform_sell(
                 message.from_user.id, app_context.db_pool_nitro, asset_code, asset_issuer, amount, app_context
             )
-            await log_xlm_volume(message.from_user.id, actual_xlm_received, response['hash'], app_context.db_pool_copytrading)
-            async with app_context.db_pool_copytrading.acquire() as conn:
-                has_referrer = await conn.fetchval(
-                    "SELECT referrer_id FROM referrals WHERE referee_id = $1", message.from_user.id
-                )
+            # Independent round trips; referral shares below read the logged volume, so they wait for both
+            _, has_referrer = await asyncio.gather(
+                log_xlm_volume(message.from_user.id, actual_xlm_received, response['hash'], app_context.db_pool_copytrading),
+                _has_referrer(app_context, message.from_user.id)
+            )
             fee = actual_xlm_received * (0.009 if has_referrer else 0.01)
-            logger.info(f"Calculated fee for user {message.from_user.id}: {fee:.7f} XLM (has_referrer: {has_referrer})")
+            logger.info("Calculated fee for user %s: %.7f XLM (has_referrer: %s)", message.from_user.id, fee, has_referrer)
             await calculate_referral_shares(app_context.db_pool_copytrading, message.from_user.id, fee)
             await message.reply(f"Sell successful. Sold {actual_amount_sent:.7f} {asset_code} for {actual_xlm_received:.7f} XLM\nTx Hash: {response['hash']}")
         else:
@@ -452,40 +492,39 @@ async def process_amount(message: types.Message, state: FSMContext, app_context)
         await message.reply(f"Error: {error_msg}")
     finally:
         await state.clear()
-        await message.reply(welcome_text, reply_markup=main_menu_keyboard, parse_mode="Markdown")
+        await message.reply(**_WELCOME_KWARGS)
 
 async def process_balance(callback: types.CallbackQuery, app_context):
     try:
         public_key = await app_context.load_public_key(callback.from_user.id)
         try:
-            account = await load_account_async(public_key, app_context)
-
-            # Fetch balances, excluding XLM
-            balance_lines = [
-                f"`{b['asset_code']}:{b['asset_issuer'] if b.get('asset_issuer') else 'Unknown'}`: {b['balance']}"
-                for b in account["balances"]
-                if b['asset_type'] != 'native'
-            ]
-            xlm_balance = float(next((b["balance"] for b in account["balances"] if b["asset_type"] == "native"), "0"))
+            account = await load_account_cached(public_key, app_context)
+
+            # Single pass over balances: native totals, trustline display lines and zero-balance trustlines
+            xlm_balance = xlm_liabilities = 0.0
+            balance_lines = []
+            zero_balance_trustlines = []
+            for b in account["balances"]:
+                if b["asset_type"] == "native":
+                    xlm_balance = float(b["balance"])
+                    xlm_liabilities = float(b["selling_liabilities"])
+                    continue
+                asset_id = f"{b['asset_code']}:{b['asset_issuer'] if b.get('asset_issuer') else 'Unknown'}"
+                balance_lines.append(f"`{asset_id}`: {b['balance']}")
+                if float(b["balance"]) == 0:
+                    zero_balance_trustlines.append(asset_id)
+            num_trustlines = len(balance_lines)
 
             # Calculate XLM usage
-            xlm_liabilities = float(next((b["selling_liabilities"] for b in account["balances"] if b["asset_type"] == "native"), "0"))
             subentry_count = account["subentry_count"]
             num_sponsoring = account.get("num_sponsoring", 0)
             num_sponsored = account.get("num_sponsored", 0)
-            trustlines = [b for b in account["balances"] if b["asset_type"] != "native"]
-            num_trustlines = len(trustlines)
             base_reserve = 2.0
             subentry_reserve = (subentry_count + num_sponsoring - num_sponsored) * 0.5
             minimum_reserve = base_reserve + subentry_reserve
             available_xlm = max(xlm_balance - xlm_liabilities - minimum_reserve, 0)
 
-            # Identify zero-balance trustlines, cap at 5 for display
-            zero_balance_trustlines = [
-                f"{b['asset_code']}:{b['asset_issuer'] if b.get('asset_issuer') else 'Unknown'}"
-                for b in trustlines
-                if float(b["balance"]) == 0
-            ]
+            # Zero-balance trustlines are capped at 5 for display
             if zero_balance_trustlines:
                 display_trustlines = zero_balance_trustlines[:5]
                 remaining = len(zero_balance_trustlines) - len(display_trustlines)
@@ -524,21 +563,20 @@ async def process_balance(callback: types.CallbackQuery, app_context):
             balance_text = "\n".join(balance_lines)
             content_text = f"{xlm_breakdown}\n\nOther Assets:\n{balance_text}" if balance_lines else f"{xlm_breakdown}"
 
+            # Greedy pagination on running line lengths; each page is joined exactly once
             available_length = max_message_length - len(header) - len(footer)
-            messages = []
-            current_message = header
             lines = content_text.split("\n")
-
-            for line in lines:
-                if len(current_message) + len(line) + 1 > max_message_length - len(footer):
-                    current_message += footer
-                    messages.append(current_message)
-                    current_message = header
-                current_message += line + "\n"
-
-            if current_message != header:
-                current_message += footer
-                messages.append(current_message)
+            messages = []
+            start = 0
+            page_length = 0
+            for i, line in enumerate(lines):
+                line_length = len(line) + 1
+                if page_length + line_length > available_length and i > start:
+                    messages.append(header + "\n".join(lines[start:i]) + "\n" + footer)
+                    start, page_length = i, 0
+                page_length += line_length
+            if start < len(lines):
+                messages.append(header + "\n".join(lines[start:]) + "\n" + footer)
 
             for i, msg in enumerate(messages):
                 if len(messages) > 1:
@@ -574,11 +612,14 @@ async def process_withdraw_asset(message: types.Message, state: FSMContext):
     if asset_input.lower() == "xlm":
         asset = Asset.native()
     else:
+        match = _ASSET_RE.fullmatch(asset_input)
+        if not match:
+            await message.reply("Invalid asset format. Use 'XLM' or 'code:issuer'")
+            return
         try:
-            code, issuer = asset_input.split(':')
-            Keypair.from_public_key(issuer)
-            asset = Asset(code, issuer)
-        except:
+            # Asset() still verifies the issuer's StrKey checksum
+            asset = Asset(*match.groups())
+        except ValueError:
             await message.reply("Invalid asset format. Use 'XLM' or 'code:issuer'")
             return
     await state.update_data(asset=asset)
@@ -587,9 +628,8 @@ async def process_withdraw_asset(message: types.Message, state: FSMContext):
 
 async def process_withdraw_address(message: types.Message, state: FSMContext):
     address = message.text.strip()
-    try:
-        Keypair.from_public_key(address)
-    except:
+    # StrKey checks the version byte and CRC16 checksum without building a Keypair
+    if not StrKey.is_valid_ed25519_public_key(address):
         await message.reply("Invalid Stellar public key.")
         return
     await state.update_data(address=address)
@@ -597,12 +637,14 @@ async def process_withdraw_address(message: types.Message, state: FSMContext):
     await state.set_state(WithdrawStates.waiting_for_amount)
 
 async def process_withdraw_amount(message: types.Message, state: FSMContext):
-    try:
-        amount = float(message.text)
-        if amount <= 0:
-            raise ValueError("Amount must be positive")
-    except ValueError as e:
-        await message.reply(f"Invalid amount: {str(e)}")
+    # Stellar amounts have at most 7 decimal places; keep them exact as Decimal
+    amount_text = message.text.strip()
+    if not _AMOUNT_RE.fullmatch(amount_text):
+        await message.reply("Invalid amount: use a positive number with up to 7 decimal places")
+        return
+    amount = Decimal(amount_text)
+    if amount <= 0:
+        await message.reply("Invalid amount: Amount must be positive")
         return
     data = await state.get_data()
     asset = data['asset']
@@ -624,7 +666,6 @@ async def process_withdraw_confirmation(callback: types.CallbackQuery, state: FS
         amount = data['amount']
         destination = data['address']
         try:
-            from services.trade_services import perform_withdraw
             response = await perform_withdraw(callback.from_user.id, app_context.db_pool_nitro, asset, amount, destination, app_context)
             await callback.message.reply(f"Withdrawal successful. Tx Hash: {response['hash']}")
         except Exception as e:
@@ -636,8 +677,7 @@ async def process_withdraw_confirmation(callback: types.CallbackQuery, state: FS
 
 async def export_rewards_command(message: types.Message, app_context):
     telegram_id = message.from_user.id
-    admin_id = os.getenv("ADMIN_TELEGRAM_ID")
-    if str(telegram_id) != admin_id:
+    if telegram_id != ADMIN_TELEGRAM_ID:
         await message.reply("You are not authorized to use this command.")
         return
     
@@ -654,91 +694,55 @@ async def export_rewards_command(message: types.Message, app_context):
 
 async def manual_payout_command(message: types.Message, app_context):
     telegram_id = message.from_user.id
-    admin_id = os.getenv("ADMIN_TELEGRAM_ID")
-    if str(telegram_id) != admin_id:
+    if telegram_id != ADMIN_TELEGRAM_ID:
         await message.reply("You are not authorized to use this command.")
         return
     chat_id = message.chat.id
     await daily_payout(app_context.db_pool_nitro, app_context.db_pool_copytrading, app_context.bot, chat_id, app_context)
 
-async def help_faq_command(message: types.Message):
-    faq_text = (
-        "*Photon Bot Help & FAQ*\n\n"
-        "*What is @Stellar_Photon_bot?*\n"
-        "Your gateway to trading on the Stellar network! Buy, sell, manage assets, follow top traders with copy trading, "
-        "and earn rewards by inviting friends.\n\n"
-        "*How do I start?*\n"
-        "Use /start to check your wallet or begin registration. You’ll get a dedicated wallet for bot trading.\n\n"
-        "*What can I do?*\n"
-        "- *Buy/Sell*: Trade assets like USDC, SHX, ETH (use buttons after /start).\n"
-        "- *Check Balance*: View your XLM and asset balances, includes reserve calculation and net available XLM.\n"
-        "- *Copy Trading*: Streams transactions from any G-address wallet with Horizon AIOHTTP and copies the trade. Multiplier, fixed-amount and slippage settings supported per copied wallet.\n"
-        "- *Withdraw*: Send XLM or assets to another Stellar address.\n"
-        "- *Referrals*: Invite friends with your referral code to earn rewards.\n"
-        "- *Trustlines*: Add (/addtrust) or remove (/removetrust) assets to trade.\n"
-        "- *Help*: Use /help for this guide.\n\n"
-        "*How do I fund my wallet?*\n"
-        "Send XLM to your wallet’s public key from an exchange (e.g., Coinbase, Kraken, Lobstr). "
-        "Fund only what you plan to trade to keep your main wallets safe.\n\n"
-        "*Do i manually have to add trustlines for copy-trading or buy/sell?*\n"
-        "No, the bot will automatically add trustlines for you when you perform a buy/sell or copy-trade.\n\n"
-        "*How do I recover my wallet?*\n"
-        "During registration, you receive a 24-word mnemonic. Store it offline (e.g., paper, USB). "
-        "To recover, import it into a Stellar wallet like Xbull or Lobstr.\n\n"
-        "*Is my wallet secure?*\n"
-        "Your wallet is generated in a secure, isolated environment with industry-standard encryption. "
-        "Your funds are safe as long as you keep your mnemonic private and delete the registration message after saving it.\n\n"
-        "*Tips*:\n"
-        "- Never share your mnemonic.\n"
-        "- Use /removetrust to free up XLM from unused trustlines.\n"
-        "- Check /help anytime for guidance.\n\n"
-        "*What Soroban functions are supported?*:\n"
-        "So far can copy trades from AQUA and Soroswap Routers, has a fallback to SDEX if Soroban copytrade fails. "
-        "More functions will be added in the future, for now only issued assets with SAC contracts and copy trading only, no direct buy/sell.\n\n"
-        "*Need more help?*\n"
-        "Message @Stellar_Photon_bot support in Telegram."
-    )
-    await message.reply(faq_text, parse_mode="Markdown")
-
-async def help_faq_callback(callback: types.CallbackQuery):
-    faq_text = (
-        "*Photon Bot Help & FAQ*\n\n"
-        "*What is @Stellar_Photon_bot?*\n"
-        "Your gateway to trading on the Stellar network! Buy, sell, manage assets, follow top traders with copy trading, "
-        "and earn rewards by inviting friends.\n\n"
-        "*How do I start?*\n"
-        "Use /start to check your wallet or begin registration. You’ll get a dedicated wallet for bot trading.\n\n"
-        "*What can I do?*\n"
-        "- *Buy/Sell*: Trade assets like USDC, SHX, ETH (use buttons after /start).\n"
-        "- *Check Balance*: View your XLM and asset balances, includes reserve calculation and net available XLM.\n"
-        "- *Copy Trading*: Streams transactions from any G-address wallet with Horizon AIOHTTP and copies the trade. Multiplier, fixed-amount and slippage settings supported per copied wallet.\n"
-        "- *Withdraw*: Send XLM or assets to another Stellar address.\n"
-        "- *Referrals*: Invite friends with your referral code to earn rewards.\n"
-        "- *Trustlines*: Add (/addtrust) or remove (/removetrust) assets to trade.\n"
-        "- *Help*: Use /help for this guide.\n\n"
-        "*How do I fund my wallet?*\n"
-        "Send XLM to your wallet’s public key from an exchange (e.g., Coinbase, Kraken, Lobstr). "
-        "Fund only what you plan to trade to keep your main wallets safe.\n\n"
-        "*Do i manually have to add trustlines for copy-trading or buy/sell?*\n"
-        "No, the bot will automatically add trustlines for you when you perform a buy/sell or copy-trade.\n\n"
-        "*How do I recover my wallet?*\n"
-        "During registration, you receive a 24-word mnemonic. Store it offline (e.g., paper, USB). "
-        "To recover, import it into a Stellar wallet like Xbull or Lobstr.\n\n"
-        "*Is my wallet secure?*\n"
-        "Your wallet is generated in a secure, isolated environment with industry-standard encryption. "
-        "Your funds are safe as long as you keep your mnemonic private and delete the registration message after saving it.\n\n"
-        "*Tips*:\n"
-        "- Never share your mnemonic.\n"
-        "- Use /removetrust to free up XLM from unused trustlines.\n"
-        "- Check /help anytime for guidance.\n\n"
-        "*What Soroban functions are supported?*:\n"
-        "So far can copy trades from AQUA and Soroswap Routers, has a fallback to SDEX if Soroban copytrade fails. "
-        "More functions will be added in the future, for now only issued assets with SAC contracts and copy trading only, no direct buy/sell.\n\n"
-        "*Need more help?*\n"
-        "Message @Stellar_Photon_bot support in Telegram."
-    )
-    await callback.message.reply(faq_text, parse_mode="Markdown")
-    await callback.answer()
+_FAQ_TEXT = (
+    "*Photon Bot Help & FAQ*\n\n"
+    "*What is @Stellar_Photon_bot?*\n"
+    "Your gateway to trading on the Stellar network! Buy, sell, manage assets, follow top traders with copy trading, "
+    "and earn rewards by inviting friends.\n\n"
+    "*How do I start?*\n"
+    "Use /start to check your wallet or begin registration. You’ll get a dedicated wallet for bot trading.\n\n"
+    "*What can I do?*\n"
+    "- *Buy/Sell*: Trade assets like USDC, SHX, ETH (use buttons after /start).\n"
+    "- *Check Balance*: View your XLM and asset balances, includes reserve calculation and net available XLM.\n"
+    "- *Copy Trading*: Streams transactions from any G-address wallet with Horizon AIOHTTP and copies the trade. Multiplier, fixed-amount and slippage settings supported per copied wallet.\n"
+    "- *Withdraw*: Send XLM or assets to another Stellar address.\n"
+    "- *Referrals*: Invite friends with your referral code to earn rewards.\n"
+    "- *Trustlines*: Add (/addtrust) or remove (/removetrust) assets to trade.\n"
+    "- *Help*: Use /help for this guide.\n\n"
+    "*How do I fund my wallet?*\n"
+    "Send XLM to your wallet’s public key from an exchange (e.g., Coinbase, Kraken, Lobstr). "
+    "Fund only what you plan to trade to keep your main wallets safe.\n\n"
+    "*Do i manually have to add trustlines for copy-trading or buy/sell?*\n"
+    "No, the bot will automatically add trustlines for you when you perform a buy/sell or copy-trade.\n\n"
+    "*How do I recover my wallet?*\n"
+    "During registration, you receive a 24-word mnemonic. Store it offline (e.g., paper, USB). "
+    "To recover, import it into a Stellar wallet like Xbull or Lobstr.\n\n"
+    "*Is my wallet secure?*\n"
+    "Your wallet is generated in a secure, isolated environment with industry-standard encryption. "
+    "Your funds are safe as long as you keep your mnemonic private and delete the registration message after saving it.\n\n"
+    "*Tips*:\n"
+    "- Never share your mnemonic.\n"
+    "- Use /removetrust to free up XLM from unused trustlines.\n"
+    "- Check /help anytime for guidance.\n\n"
+    "*What Soroban functions are supported?*:\n"
+    "So far can copy trades from AQUA and Soroswap Routers, has a fallback to SDEX if Soroban copytrade fails. "
+    "More functions will be added in the future, for now only issued assets with SAC contracts and copy trading only, no direct buy/sell.\n\n"
+    "*Need more help?*\n"
+    "Message @Stellar_Photon_bot support in Telegram."
+)
+
+async def help_faq(event: types.Message | types.CallbackQuery):
+    # Serves both /help and the Help/FAQ button
+    is_callback = isinstance(event, types.CallbackQuery)
+    await (event.message if is_callback else event).reply(_FAQ_TEXT, parse_mode="Markdown")
+    if is_callback:
+        await event.answer()
 
 async def process_add_trustline(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.reply("Please enter the asset to add trustline for in the format: code:issuer")
@@ -761,11 +765,11 @@ async def remove_trust_command(message: types.Message, state: FSMContext):
 async def process_add_trustline_asset(message: types.Message, state: FSMContext, app_context):
     asset_input = message.text.strip()
     try:
-        code, issuer = asset_input.split(':')
-        if not issuer.startswith('G') or len(issuer) != 56:
-            raise ValueError("Issuer must be a valid Stellar public key")
+        match = _ASSET_RE.fullmatch(asset_input)
+        if not match:
+            raise ValueError("Use code:issuer with a 1-12 character code and a Stellar public key issuer")
+        code, issuer = match.groups()
         
-        from services.trade_services import perform_add_trustline
         response = await perform_add_trustline(message.from_user.id, app_context.db_pool_nitro, code, issuer, app_context)
         await message.reply(f"Trustline added successfully for {code}:{issuer}. Tx Hash: {response['hash']}")
     except Exception as e:
@@ -773,16 +777,16 @@ async def process_add_trustline_asset(message: types.Message, state: FSMContext,
         await message.reply(f"Error adding trustline: {str(e)}")
     finally:
         await state.clear()
-        await message.reply(welcome_text, reply_markup=main_menu_keyboard, parse_mode="Markdown")
+        await message.reply(**_WELCOME_KWARGS)
 
 async def process_remove_trustline_asset(message: types.Message, state: FSMContext, app_context):
     asset_input = message.text.strip()
     try:
-        code, issuer = asset_input.split(':')
-        if not issuer.startswith('G') or len(issuer) != 56:
-            raise ValueError("Issuer must be a valid Stellar public key")
+        match = _ASSET_RE.fullmatch(asset_input)
+        if not match:
+            raise ValueError("Use code:issuer with a 1-12 character code and a Stellar public key issuer")
+        code, issuer = match.groups()
         
-        from services.trade_services import perform_remove_trustline
         response = await perform_remove_trustline(message.from_user.id, app_context.db_pool_nitro, code, issuer, app_context)
         await message.reply(f"Trustline removed successfully for {code}:{issuer}. Tx Hash: {response['hash']}")
     except Exception as e:
@@ -790,7 +794,7 @@ async def process_remove_trustline_asset(message: types.Message, state: FSMConte
         await message.reply(f"Error removing trustline: {str(e)}")
     finally:
         await state.clear()
-        await message.reply(welcome_text, reply_markup=main_menu_keyboard, parse_mode="Markdown")
+        await message.reply(**_WELCOME_KWARGS)
 
 def register_main_handlers(dp, app_context, streaming_service):
     async def start_handler(message: types.Message, state: FSMContext):
@@ -803,50 +807,52 @@ def register_main_handlers(dp, app_context, streaming_service):
         await register_command(message, app_context, state)
     dp.message.register(register_handler, Command("register"))
     
-    dp.callback_query.register(process_buy_sell, lambda c: c.data in ["buy", "sell"])
+    # Static main-menu buttons are routed through one dict lookup instead of a filter per button
+    callback_routes = {
+        "buy": process_buy_sell,
+        "sell": process_buy_sell,
+        "balance": lambda callback, state: process_balance(callback, app_context),
+        "register": lambda callback, state: process_register_callback(callback, app_context, state),
+        "copy_trading": lambda callback, state: process_copy_trading_callback(callback, app_context, streaming_service),
+        "withdraw": process_withdraw,
+        "help_faq": lambda callback, state: help_faq(callback),
+        "add_trustline": process_add_trustline,
+        "remove_trustline": process_remove_trustline,
+    }
+    async def main_menu_callback_handler(callback: types.CallbackQuery, state: FSMContext):
+        await callback_routes[callback.data](callback, state)
+    dp.callback_query.register(main_menu_callback_handler, F.data.in_(callback_routes.keys()))
+
     dp.message.register(process_asset, BuySellStates.waiting_for_asset)
     
     async def amount_handler(message: types.Message, state: FSMContext):
         await process_amount(message, state, app_context)
     dp.message.register(amount_handler, BuySellStates.waiting_for_amount)
     
-    async def balance_handler(callback: types.CallbackQuery):
-        await process_balance(callback, app_context)
-    dp.callback_query.register(balance_handler, lambda c: c.data == "balance")
-    
-    async def register_callback_handler(callback: types.CallbackQuery, state: FSMContext):
-        await process_register_callback(callback, app_context, state)
-    dp.callback_query.register(register_callback_handler, lambda c: c.data == "register")
-    
-    async def copy_trading_handler(callback: types.CallbackQuery):
-        await process_copy_trading_callback(callback, app_context, streaming_service)
-    dp.callback_query.register(copy_trading_handler, lambda c: c.data == "copy_trading")
-    
     async def unregister_handler(message: types.Message):
         await unregister_command(message, app_context, streaming_service)
     dp.message.register(unregister_handler, Command("unregister"))
 
-    dp.callback_query.register(process_withdraw, lambda c: c.data == "withdraw")
-    dp.message.register(process_withdraw_asset, WithdrawStates.waiting_for_asset)
-    dp.message.register(process_withdraw_address, WithdrawStates.waiting_for_address)
-    dp.message.register(process_withdraw_amount, WithdrawStates.waiting_for_amount)
+    # Withdraw text steps share one handler: a single state read and dict lookup per message
+    withdraw_routes = {
+        WithdrawStates.waiting_for_asset.state: process_withdraw_asset,
+        WithdrawStates.waiting_for_address.state: process_withdraw_address,
+        WithdrawStates.waiting_for_amount.state: process_withdraw_amount,
+    }
+    async def withdraw_message_handler(message: types.Message, state: FSMContext, raw_state: str):
+        await withdraw_routes[raw_state](message, state)
+    dp.message.register(withdraw_message_handler, StateFilter(*withdraw_routes))
     async def withdraw_confirmation_handler(callback: types.CallbackQuery, state: FSMContext):
         await process_withdraw_confirmation(callback, state, app_context)
     dp.callback_query.register(withdraw_confirmation_handler, WithdrawStates.waiting_for_confirmation)
 
-    async def seed_saved_wrapper(callback: types.CallbackQuery):
-        return await confirm_seed_saved(callback, app_context)
-    dp.callback_query.register(
-        seed_saved_wrapper,
-        lambda c: c.data.startswith("seed_saved_")
-    )
+    async def seed_saved_wrapper(callback: types.CallbackQuery, callback_data: SeedSavedCallback):
+        return await confirm_seed_saved(callback, callback_data, app_context)
+    dp.callback_query.register(seed_saved_wrapper, SeedSavedCallback.filter())
 
-    async def unregister_wrapper(callback: types.CallbackQuery):
-        return await confirm_unregister(callback, app_context, streaming_service)
-    dp.callback_query.register(
-        unregister_wrapper,
-        lambda c: c.data.startswith(("confirm_unregister_", "cancel_unregister_"))
-    )
+    async def unregister_wrapper(callback: types.CallbackQuery, callback_data: UnregisterCallback):
+        return await confirm_unregister(callback, callback_data, app_context, streaming_service)
+    dp.callback_query.register(unregister_wrapper, UnregisterCallback.filter())
 
     async def export_handler(message: types.Message):
         await export_rewards_command(message, app_context)
@@ -860,11 +866,7 @@ def register_main_handlers(dp, app_context, streaming_service):
         await manual_payout_command(message, app_context)
     dp.message.register(manual_payout_handler, Command("manual_payout"))
 
-    dp.message.register(help_faq_command, Command("help"))
-    dp.callback_query.register(help_faq_callback, lambda c: c.data == "help_faq")
-    
-    dp.callback_query.register(process_add_trustline, lambda c: c.data == "add_trustline")
-    dp.callback_query.register(process_remove_trustline, lambda c: c.data == "remove_trustline")
+    dp.message.register(help_faq, Command("help"))
     
     dp.message.register(add_trust_command, Command("addtrust"))
     dp.message.register(remove_trust_command, Command("removetrust"))
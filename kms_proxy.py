@@ -1,9 +1,14 @@
+import asyncio
 import base64
-import json
+import hashlib
 import logging
+import orjson
 import socket
+import threading
 import boto3
+from botocore.config import Config
 from botocore.session import Session
+from collections import OrderedDict
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -12,6 +17,41 @@ logger = logging.getLogger(__name__)
 # VSOCK configuration for KMS requests
 KMS_VSOCK_PORT = 8001
 
+# One botocore Session (service models, endpoint data) for the process; clients are cached
+# per credential set since the parent rotates temporary credentials only occasionally
+_session = Session()
+_session.set_config_variable('metadata_service_timeout', 1)
+_session.set_config_variable('metadata_service_num_attempts', 1)
+_CLIENT_CACHE = OrderedDict()
+_CLIENT_CACHE_SIZE = 8
+# Decrypts run in worker threads; Session.create_client isn't thread-safe and the LRU
+# bookkeeping mutates the dict, so lookup/create/evict happen under one lock
+_CLIENT_CACHE_LOCK = threading.Lock()
+# Warm connections come from each cached client's urllib3 pool; TCP keepalive only lets
+# the OS detect pooled sockets that died while idle, so they aren't reused after a drop
+_KMS_CLIENT_CONFIG = Config(tcp_keepalive=True, max_pool_connections=10)
+
+def get_kms_client(access_key, secret_key, token):
+    # Hash the credentials so they aren't held in cleartext as dict keys
+    key = hashlib.sha256(f"{access_key}:{secret_key}:{token}".encode()).digest()
+    with _CLIENT_CACHE_LOCK:
+        kms_client = _CLIENT_CACHE.get(key)
+        if kms_client is not None:
+            _CLIENT_CACHE.move_to_end(key)
+            return kms_client
+        kms_client = _session.create_client(
+            'kms',
+            region_name='us-west-1',
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            aws_session_token=token,
+            config=_KMS_CLIENT_CONFIG
+        )
+        _CLIENT_CACHE[key] = kms_client
+        if len(_CLIENT_CACHE) > _CLIENT_CACHE_SIZE:
+            _CLIENT_CACHE.popitem(last=False)
+        return kms_client
+
 def handle_kms_decrypt(ciphertext, aws_credentials):
     try:
         # Extract credentials
@@ -22,18 +62,7 @@ def handle_kms_decrypt(ciphertext, aws_credentials):
         if not access_key or not secret_key or not token:
             raise ValueError("Incomplete AWS credentials")
 
-        # Create a boto3 session with the provided credentials
-        session = Session()
-        session.set_config_variable('metadata_service_timeout', 1)
-        session.set_config_variable('metadata_service_num_attempts', 1)
-
-        kms_client = session.create_client(
-            'kms',
-            region_name='us-west-1',
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            aws_session_token=token
-        )
+        kms_client = get_kms_client(access_key, secret_key, token)
 
         # Decrypt the ciphertext
         response = kms_client.decrypt(CiphertextBlob=base64.b64decode(ciphertext))
@@ -43,45 +72,50 @@ def handle_kms_decrypt(ciphertext, aws_credentials):
         logger.error(f"KMS decrypt error: {str(e)}")
         return {"error": str(e)}
 
-def handle_connection(conn):
+async def handle_connection(reader, writer):
     try:
         # Receive length prefix
-        length_prefix = conn.recv(4)
-        if len(length_prefix) != 4:
-            raise ValueError("Failed to read length prefix")
+        length_prefix = await reader.readexactly(4)
         length = int.from_bytes(length_prefix, byteorder='big')
         logger.debug(f"Expecting KMS request of length: {length}")
 
         # Receive the request
-        data = conn.recv(length).decode('utf-8')
-        request = json.loads(data)
+        data = await reader.readexactly(length)
+        request = orjson.loads(data)
         logger.debug(f"Received KMS request: {request}")
 
-        # Process the request
+        # Process the request; botocore is blocking, so run it in a worker thread
         if request.get("action") == "kms_decrypt":
-            response = handle_kms_decrypt(request["ciphertext"], request["aws_credentials"])
+            response = await asyncio.to_thread(handle_kms_decrypt, request["ciphertext"], request["aws_credentials"])
         else:
             response = {"error": "Unknown action"}
 
         # Send response
-        response_data = json.dumps(response).encode('utf-8')
+        response_data = orjson.dumps(response)
         length_prefix = len(response_data).to_bytes(4, byteorder='big')
-        conn.send(length_prefix + response_data)
+        writer.write(length_prefix + response_data)
+        await writer.drain()
+    except asyncio.IncompleteReadError as e:
+        logger.error(f"KMS proxy connection closed early: got {len(e.partial)} of {e.expected} bytes")
     except Exception as e:
         logger.error(f"KMS proxy connection error: {str(e)}")
     finally:
-        conn.close()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
 
-def main():
+async def main():
     sock = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
     sock.bind((socket.VMADDR_CID_ANY, KMS_VSOCK_PORT))
-    sock.listen(1)
+    sock.listen(128)
+    sock.setblocking(False)
+    # Each connection is handled as its own task, so concurrent enclave requests overlap their KMS calls
+    server = await asyncio.start_server(handle_connection, sock=sock)
     logger.info(f"KMS proxy listening on VSOCK port {KMS_VSOCK_PORT}")
-
-    while True:
-        conn, addr = sock.accept()
-        logger.debug(f"Accepted KMS request connection from {addr}")
-        handle_connection(conn)
+    async with server:
+        await server.serve_forever()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,11 +1,13 @@
 import asyncio
 import asyncpg
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.fsm.storage.memory import MemoryStorage
 from globals import AppContext, TELEGRAM_TOKEN
 from services.streaming import StreamingService
 from handlers.referrals import register_referral_handlers
 from core.stellar import load_public_key
+from core.rate_limit import TokenBucketLimiter
 from handlers.main_menu import register_main_handlers
 from handlers.copy_trading import register_copy_handlers
 import logging
@@ -13,24 +15,28 @@ from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 import os
 from stellar_sdk import Keypair
-from services.referrals import daily_payout
+from stellar_sdk.strkey import StrKey
+from services.referrals import daily_payout, prepare_hot_statements
 import socket
 import json
+import time
+import random
+import re
+import orjson
 import base64
 import boto3
 from botocore.exceptions import ClientError
-from cryptography.fernet import Fernet
+from enclave.secret_blob import encrypt_secret
+
+# From the recovery_secret key up to the closing brace of the enclosing dict
+_RECOVERY_SECRET_RE = re.compile(r"recovery_secret[^}]*\}")
 
 class RedactMnemonicFilter(logging.Filter):
     def filter(self, record):
-        if hasattr(record, 'msg') and 'recovery_secret' in str(record.msg):
-            start_idx = record.msg.find('recovery_secret')
-            end_idx = record.msg.find('}', start_idx) + 1
-            if end_idx > start_idx:
-                record.msg = record.msg.replace(
-                    record.msg[start_idx:end_idx],
-                    'recovery_secret: [REDACTED]'
-                )
+        msg = record.msg
+        # Plain substring test first so records without the key skip the regex entirely
+        if isinstance(msg, str) and 'recovery_secret' in msg:
+            record.msg = _RECOVERY_SECRET_RE.sub('recovery_secret: [REDACTED]', msg)
         return True
 
 # Configure logging (once)
@@ -42,9 +48,37 @@ logger.addFilter(RedactMnemonicFilter())
 logger.info(f"Current working directory: {os.getcwd()}")
 logger.info(f"FEE_WALLET from os.getenv at startup: {os.getenv('FEE_WALLET')}")
 
+# boto3 clients are thread-safe and costly to build; create each one once and reuse it
+_aws_clients = {}
+
+def get_aws_client(service_name):
+    client = _aws_clients.get(service_name)
+    if client is None:
+        client = _aws_clients[service_name] = boto3.client(service_name, region_name='us-west-1')
+    return client
+
+_aws_credentials = None
+
+def get_aws_credentials():
+    """Return the instance credentials handed to the enclave for KMS decrypts.
+
+    The provider chain is resolved once; botocore refreshes the credentials object
+    in place before it expires, so each call only snapshots the current values.
+    """
+    global _aws_credentials
+    if _aws_credentials is None:
+        _aws_credentials = boto3.Session().get_credentials()
+    frozen = _aws_credentials.get_frozen_credentials()
+    return {
+        "aws_access_key_id": frozen.access_key,
+        "aws_secret_access_key": frozen.secret_key,
+        "aws_session_token": frozen.token
+    }
+
 async def init_db_pool_nitro():
-    client = boto3.client('secretsmanager', region_name='us-west-1')
-    secret = client.get_secret_value(
+    client = get_aws_client('secretsmanager')
+    secret = await asyncio.to_thread(
+        client.get_secret_value,
         SecretId='arn:aws:secretsmanager:us-west-1:783906944039:secret:rds!db-2613ba5a-9276-4830-908f-5bfab8cb0497-cPGCqs'
     )
     creds = json.loads(secret['SecretString'])
@@ -53,7 +87,13 @@ async def init_db_pool_nitro():
         password=creds['password'],
         database='nitro',
         host='trading-bot-db1-nitro.cz2imkksk7b4.us-west-1.rds.amazonaws.com',
-        port=5432
+        port=5432,
+        min_size=10,
+        max_size=50,
+        max_inactive_connection_lifetime=300,
+        statement_cache_size=1024,
+        command_timeout=10,
+        init=prepare_signing_statements
     )
 
 async def init_db_pool_copytrading():
@@ -66,12 +106,18 @@ async def init_db_pool_copytrading():
         password=copytrading_password,
         database='copytrading',
         host='trading-bot-db2.cz2imkksk7b4.us-west-1.rds.amazonaws.com',
-        port=5433
+        port=5433,
+        min_size=10,
+        max_size=50,
+        max_inactive_connection_lifetime=300,
+        statement_cache_size=1024,
+        command_timeout=10,
+        init=prepare_hot_statements
     )
 
 def generate_data_key():
     try:
-        kms_client = boto3.client('kms', region_name='us-west-1')
+        kms_client = get_aws_client('kms')
         response = kms_client.generate_data_key(
             KeyId='arn:aws:kms:us-west-1:961017070653:key/cd27efb2-0e00-44f5-b218-cb5a6e671a82',
             KeySpec='AES_256'
@@ -84,38 +130,92 @@ def generate_data_key():
         logger.error(f"KMS GenerateDataKey failed: {str(e)}")
         raise
 
-async def communicate_with_enclave(request, cid=50, port=5000):
-    client = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
-    try:
-        client.connect((cid, port))
-        request_data = json.dumps(request).encode('utf-8')
-        # Send length as a 4-byte binary integer (big-endian)
-        length = len(request_data)
-        length_prefix = length.to_bytes(4, byteorder='big')
-        logger.debug(f"Sending length: {length} bytes")
-        client.send(length_prefix + request_data)
-        
-        # Receive length prefix as a 4-byte binary integer
-        length_prefix = client.recv(4)
-        if len(length_prefix) != 4:
-            raise ValueError("Failed to read length prefix from enclave")
-        length = int.from_bytes(length_prefix, byteorder='big')
+class EnclaveConnectionPool:
+    """Keeps up to max_size vsock connections to the enclave open between requests.
+
+    Each request is one length-prefixed JSON frame each way. A connection that fails is
+    discarded; if it was a reused idle one (e.g. the enclave restarted), the request is
+    retried once on a freshly dialed connection.
+    """
+
+    def __init__(self, cid=50, port=5000, max_size=8):
+        self.cid = cid
+        self.port = port
+        self.idle = []
+        self.semaphore = asyncio.Semaphore(max_size)
+
+    async def _connect(self):
+        sock = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.get_running_loop().sock_connect(sock, (self.cid, self.port))
+        except BaseException:
+            sock.close()
+            raise
+        return await asyncio.open_connection(sock=sock)
+
+    @staticmethod
+    async def _roundtrip(reader, writer, request):
+        request_data = orjson.dumps(request)
+        # Length as a 4-byte binary integer (big-endian), handed to the transport with the
+        # payload in one call rather than concatenated into a new bytes object
+        logger.debug(f"Sending length: {len(request_data)} bytes")
+        writer.writelines((len(request_data).to_bytes(4, byteorder='big'), request_data))
+        await writer.drain()
+        length = int.from_bytes(await reader.readexactly(4), byteorder='big')
         logger.debug(f"Expecting response of length: {length}")
-        
-        # Receive the response data
-        response_data = client.recv(length).decode('utf-8')
-        response = json.loads(response_data)
+        return orjson.loads(await reader.readexactly(length))
+
+    async def request(self, request):
+        async with self.semaphore:
+            reused = bool(self.idle)
+            reader, writer = self.idle.pop() if reused else await self._connect()
+            try:
+                response = await self._roundtrip(reader, writer, request)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if not reused:
+                    raise
+                reader, writer = await self._connect()
+                try:
+                    response = await self._roundtrip(reader, writer, request)
+                except BaseException:
+                    writer.close()
+                    raise
+            except BaseException:
+                writer.close()
+                raise
+            self.idle.append((reader, writer))
+            return response
+
+    async def close(self):
+        idle, self.idle = self.idle, []
+        for _, writer in idle:
+            writer.close()
+
+_enclave_pool = EnclaveConnectionPool(cid=50, port=5000, max_size=int(os.getenv("ENCLAVE_POOL_SIZE", "8")))
+
+async def communicate_with_enclave(request):
+    try:
+        response = await _enclave_pool.request(request)
         logger.debug(f"Received response from enclave: {response}")
         return response
     except Exception as e:
         logger.error(f"Enclave communication error: {str(e)}")
-        raise TimeoutError(f"Failed to connect to enclave at CID {cid}, port {port}")
-    finally:
-        client.close()
+        raise TimeoutError(f"Failed to reach enclave at CID {_enclave_pool.cid}, port {_enclave_pool.port}")
+
+# One round-trip and no check-then-write race; xmax = 0 only for a freshly inserted row
+UPSERT_USER_QUERY = (
+    "INSERT INTO users (telegram_id, public_key, encrypted_secret, encrypted_data_key) "
+    "VALUES ($1, $2, $3, $4) "
+    "ON CONFLICT (telegram_id) DO UPDATE SET public_key = EXCLUDED.public_key, "
+    "encrypted_secret = EXCLUDED.encrypted_secret, encrypted_data_key = EXCLUDED.encrypted_data_key "
+    "RETURNING (xmax = 0) AS inserted"
+)
 
 async def generate_keypair(telegram_id, db_pool):
-    # Generate data key on the parent side
-    kms_response = generate_data_key()
+    # Generate data key on the parent side; the KMS call blocks, so keep it off the event loop
+    kms_response = await asyncio.to_thread(generate_data_key)
     data_key = kms_response["Plaintext"]
     encrypted_data_key = kms_response["CiphertextBlob"]
 
@@ -129,50 +229,42 @@ async def generate_keypair(telegram_id, db_pool):
     if "error" in response:
         raise ValueError(response["error"])
 
-    async with db_pool.acquire() as conn:
-        exists = await conn.fetchval(
-            "SELECT telegram_id FROM users WHERE telegram_id = $1", int(telegram_id)
-        )
-        if exists:
-            await conn.execute(
-                "UPDATE users SET public_key = $1, encrypted_secret = $2, encrypted_data_key = $3 "
-                "WHERE telegram_id = $4",
-                response["public_key"],
-                response["encrypted_secret"],
-                response["encrypted_data_key"],
-                int(telegram_id)
-            )
-            logger.info(f"Updated user in nitro.db with telegram_id {telegram_id}")
-        else:
-            await conn.execute(
-                "INSERT INTO users (telegram_id, public_key, encrypted_secret, encrypted_data_key) "
-                "VALUES ($1, $2, $3, $4)",
-                int(telegram_id),
-                response["public_key"],
-                response["encrypted_secret"],
-                response["encrypted_data_key"]
-            )
-            logger.info(f"Inserted user into nitro.db with telegram_id {telegram_id}")
+    inserted = await db_pool.fetchval(
+        UPSERT_USER_QUERY,
+        int(telegram_id),
+        response["public_key"],
+        response["encrypted_secret"],
+        response["encrypted_data_key"]
+    )
+    if inserted:
+        logger.info(f"Inserted user into nitro.db with telegram_id {telegram_id}")
+    else:
+        logger.info(f"Updated user in nitro.db with telegram_id {telegram_id}")
     return response  # Return the full response dictionary
 
-async def sign_transaction(telegram_id, transaction_xdr, db_pool):
+SIGNING_USER_QUERY = "SELECT public_key, encrypted_secret, encrypted_data_key FROM users WHERE telegram_id = $1"
+
+async def prepare_signing_statements(conn):
+    """Pool init hook: put the per-signature user lookup into the connection's statement cache."""
+    # Connection.prepare() bypasses the statement cache, so run the query once to populate it
+    await conn.fetchrow(SIGNING_USER_QUERY, 0)
+
+async def load_signing_user(telegram_id, db_pool):
+    """Fetch the public key and encrypted key material for telegram_id in one query."""
     async with db_pool.acquire() as conn:
-        user_data = await conn.fetchrow(
-            "SELECT public_key, encrypted_secret, encrypted_data_key FROM users WHERE telegram_id = $1",
-            int(telegram_id)
-        )
-        if not user_data:
-            logger.error(f"No keypair found for telegram_id {telegram_id}")
-            raise ValueError(f"No keypair found for telegram_id {telegram_id}")
-
-    # Retrieve temporary AWS credentials from the parent instance
-    session = boto3.Session()
-    credentials = session.get_credentials()
-    aws_credentials = {
-        "aws_access_key_id": credentials.access_key,
-        "aws_secret_access_key": credentials.secret_key,
-        "aws_session_token": credentials.token
-    }
+        user_data = await conn.fetchrow(SIGNING_USER_QUERY, int(telegram_id))
+    if not user_data:
+        logger.error(f"No keypair found for telegram_id {telegram_id}")
+        raise ValueError(f"No keypair found for telegram_id {telegram_id}")
+    return user_data
+
+async def sign_transaction(telegram_id, transaction_xdr, db_pool, user_data=None):
+    # user_data may be prefetched by the caller via load_signing_user
+    if user_data is None:
+        user_data = await load_signing_user(telegram_id, db_pool)
+
+    # Temporary AWS credentials from the parent instance
+    aws_credentials = get_aws_credentials()
 
     request = {
         "action": "sign",
@@ -188,23 +280,37 @@ async def sign_transaction(telegram_id, transaction_xdr, db_pool):
         raise ValueError(response["error"])
     return response["signed_transaction"]
 
+SHUTDOWN_DRAIN_TIMEOUT = 5.0
+
 async def shutdown(app_context, streaming_service):
     logger.info("Initiating shutdown...")
+    # Cancel every background task (streams included) at once so their cleanups overlap,
+    # and bound the wait so one stuck finally block can't hold up shutdown
+    pending = [task for task in app_context.tasks if not task.done()]
+    for task in pending:
+        task.cancel()
+    if pending:
+        done, stuck = await asyncio.wait(pending, timeout=SHUTDOWN_DRAIN_TIMEOUT)
+        await asyncio.gather(*done, return_exceptions=True)
+        if stuck:
+            logger.warning(f"{len(stuck)} tasks still running after {SHUTDOWN_DRAIN_TIMEOUT}s; abandoning them")
+    app_context.tasks.clear()
     if streaming_service:
+        # Stream tasks are already cancelled above; this just clears per-chat bookkeeping
         for chat_id in list(streaming_service.tasks.keys()):
             try:
                 await streaming_service.stop_streaming(chat_id)
             except Exception as e:
                 logger.warning(f"Failed to stop streaming for chat_id {chat_id}: {str(e)}")
-    for task in app_context.tasks:
-        if not task.done():
-            task.cancel()
-    await asyncio.gather(*app_context.tasks, return_exceptions=True)
     await app_context.shutdown()
+    await _enclave_pool.close()
     if app_context.bot:
         await app_context.bot.session.close()
     logger.info("Bot stopped gracefully.")
 
+DAILY_PAYOUT_JITTER_SECONDS = 60.0
+DAILY_PAYOUT_TIMEOUT = float(os.getenv("DAILY_PAYOUT_TIMEOUT", "3600"))
+
 async def schedule_daily_payout(app_context, streaming_service, chat_id=None):
     if chat_id is None:
         admin_id = os.getenv("ADMIN_TELEGRAM_ID")
@@ -220,11 +326,20 @@ async def schedule_daily_payout(app_context, streaming_service, chat_id=None):
     while not app_context.shutdown_flag.is_set():
         now = datetime.now(ZoneInfo("UTC"))
         next_run = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
-        logger.info("Next payout scheduled for %s UTC", next_run)
-        await asyncio.sleep((next_run - now).total_seconds())
+        wake_at = next_run + timedelta(seconds=random.uniform(0, DAILY_PAYOUT_JITTER_SECONDS))
+        logger.info("Next payout scheduled for %s UTC", wake_at)
+        # Re-check the wall clock after each sleep so an early wake can't run the payout twice in one day
+        while (remaining := (wake_at - datetime.now(ZoneInfo("UTC"))).total_seconds()) > 0:
+            await asyncio.sleep(remaining)
         logger.info("Running daily payout at %s UTC", datetime.now(ZoneInfo("UTC")))
         try:
-            await daily_payout(app_context.db_pool_nitro, app_context.db_pool_copytrading, app_context.bot, chat_id, app_context)
+            # A deadline rather than a cancellation: daily_payout stops between batches, never
+            # between submitting a batch and marking it paid
+            deadline = asyncio.get_running_loop().time() + DAILY_PAYOUT_TIMEOUT
+            await daily_payout(
+                app_context.db_pool_nitro, app_context.db_pool_copytrading, app_context.bot, chat_id, app_context,
+                deadline=deadline,
+            )
         except Exception as e:
             logger.error(f"Daily payout failed: {str(e)}", exc_info=True)
             if chat_id:
@@ -254,14 +369,6 @@ async def setup_fee_wallet(app_context):
         logger.error(f"DISBURSEMENT_WALLET_SECRET does not match DISBURSEMENT_WALLET public key: {fee_public_key} != {disbursement_wallet_public}")
         raise ValueError("DISBURSEMENT_WALLET_SECRET does not match DISBURSEMENT_WALLET public key")
 
-    if not app_context.fee_wallet:
-        logger.error("FEE_WALLET not found in .env")
-        raise ValueError("FEE_WALLET not found in .env")
-    try:
-        Keypair.from_public_key(app_context.fee_wallet)
-    except Exception:
-        raise ValueError("Invalid FEE_WALLET address")
-
     # Generate keypair in the enclave
     response = await generate_keypair(fee_telegram_id, app_context.db_pool_nitro)
     if "error" in response:
@@ -269,40 +376,27 @@ async def setup_fee_wallet(app_context):
 
     encrypted_data_key = response["encrypted_data_key"]
 
-    kms_client = boto3.client('kms', region_name='us-west-1')
-    response = kms_client.decrypt(
+    kms_client = get_aws_client('kms')
+    response = await asyncio.to_thread(
+        kms_client.decrypt,
         CiphertextBlob=base64.b64decode(encrypted_data_key)
     )
     data_key = response['Plaintext']
     logger.debug("Decryption of encrypted_data_key successful")
 
-    cipher = Fernet(base64.urlsafe_b64encode(data_key))
-    encrypted_secret = cipher.encrypt(fee_keypair.secret.encode()).hex()
+    encrypted_secret = encrypt_secret(data_key, fee_keypair.secret)
 
-    async with app_context.db_pool_nitro.acquire() as conn:
-        exists = await conn.fetchval(
-            "SELECT telegram_id FROM users WHERE telegram_id = $1", fee_telegram_id
-        )
-        if exists:
-            await conn.execute(
-                "UPDATE users SET public_key = $1, encrypted_secret = $2, encrypted_data_key = $3 "
-                "WHERE telegram_id = $4",
-                fee_public_key,
-                encrypted_secret,
-                encrypted_data_key,
-                fee_telegram_id
-            )
-            logger.info(f"Updated fee wallet in nitro.db with telegram_id {fee_telegram_id}")
-        else:
-            await conn.execute(
-                "INSERT INTO users (telegram_id, public_key, encrypted_secret, encrypted_data_key) "
-                "VALUES ($1, $2, $3, $4)",
-                fee_telegram_id,
-                fee_public_key,
-                encrypted_secret,
-                encrypted_data_key
-            )
-            logger.info(f"Inserted fee wallet into nitro.db with telegram_id {fee_telegram_id}")
+    inserted = await app_context.db_pool_nitro.fetchval(
+        UPSERT_USER_QUERY,
+        fee_telegram_id,
+        fee_public_key,
+        encrypted_secret,
+        encrypted_data_key
+    )
+    if inserted:
+        logger.info(f"Inserted fee wallet into nitro.db with telegram_id {fee_telegram_id}")
+    else:
+        logger.info(f"Updated fee wallet in nitro.db with telegram_id {fee_telegram_id}")
 
     app_context.fee_telegram_id = fee_telegram_id
 
@@ -311,7 +405,17 @@ async def run_master():
     db_pool_copytrading = await init_db_pool_copytrading()
 
     app_context = AppContext(db_pool_nitro=db_pool_nitro, db_pool_copytrading=db_pool_copytrading)
-    app_context.bot = Bot(token=TELEGRAM_TOKEN)
+    # Telegram caps outbound traffic at ~30 messages/s per bot; throttle every API call
+    # through one token bucket, capped at the session's default 100-connection pool.
+    session = AiohttpSession()
+    telegram_limiter = TokenBucketLimiter(rate=30.0, capacity=30, max_concurrency=100)
+
+    async def throttle_telegram(make_request, bot, method):
+        async with telegram_limiter:
+            return await make_request(bot, method)
+
+    session.middleware(throttle_telegram)
+    app_context.bot = Bot(token=TELEGRAM_TOKEN, session=session)
     storage = MemoryStorage()
     app_context.dp = Dispatcher(storage=storage)
 
@@ -319,9 +423,7 @@ async def run_master():
     logger.info(f"Loaded FEE_WALLET into app_context: {app_context.fee_wallet}")
     if not app_context.fee_wallet:
         raise ValueError("FEE_WALLET not found in .env")
-    try:
-        Keypair.from_public_key(app_context.fee_wallet)
-    except Exception:
+    if not StrKey.is_valid_ed25519_public_key(app_context.fee_wallet):
         raise ValueError("Invalid FEE_WALLET address")
 
     # Setup the fee wallet in nitro.db
@@ -333,10 +435,15 @@ async def run_master():
     app_context.generate_keypair = wrapped_generate_keypair
 
     # Attach sign_transaction
-    async def wrapped_sign_transaction(telegram_id, transaction_xdr):
-        return await sign_transaction(telegram_id, transaction_xdr, app_context.db_pool_nitro)
+    async def wrapped_sign_transaction(telegram_id, transaction_xdr, user_data=None):
+        return await sign_transaction(telegram_id, transaction_xdr, app_context.db_pool_nitro, user_data)
     app_context.sign_transaction = wrapped_sign_transaction
 
+    # Attach load_signing_user so flows can fetch wallet + key material once up front
+    async def wrapped_load_signing_user(telegram_id):
+        return await load_signing_user(telegram_id, app_context.db_pool_nitro)
+    app_context.load_signing_user = wrapped_load_signing_user
+
     # Attach transaction_signer for AssembledTransactionAsync
     async def wrapped_enclave_signer(telegram_id, transaction_xdr):
         return await enclave_signer(telegram_id, transaction_xdr, app_context.db_pool_nitro)
@@ -368,14 +475,21 @@ async def run_master():
     app_context.tasks.append(asyncio.create_task(schedule_daily_payout(app_context, streaming_service, chat_id=5014800072)))
 
     while retry_count < max_retries:
+        started_at = time.monotonic()
         try:
             await app_context.dp.start_polling(app_context.bot)
             break
         except Exception as e:
             logger.error(f"Polling failed: {str(e)}")
+            # A run that stayed up for a while was a fresh failure, not part of a crash loop
+            if time.monotonic() - started_at > 60:
+                retry_count = 0
             retry_count += 1
-            delay = min(retry_delay * (2 ** retry_count), max_delay)
-            logger.warning(f"Retrying in {delay} seconds (attempt {retry_count})...")
+            # Cap the exponent and add jitter so restarting instances don't retry in lockstep
+            delay = min(retry_delay * (2 ** min(retry_count, 6)), max_delay) * random.uniform(0.5, 1.5)
+            logger.warning(
+                "Retrying polling in %.1f seconds (attempt=%d, error=%s)", delay, retry_count, type(e).__name__
+            )
             await asyncio.sleep(delay)
         except (KeyboardInterrupt, asyncio.CancelledError):
             await shutdown(app_context, streaming_service)
@@ -1,32 +1,50 @@
-from decimal import Decimal, getcontext, ROUND_DOWN
+from decimal import Decimal, ROUND_DOWN
 from typing import Dict, List, Any
 
 
-# Increase precision to handle large share numbers safely.
-getcontext().prec = 50
-
+# Stellar amounts are fixed-point with 7 decimals; all payout math is done in integer stroops.
+STROOPS_PER_UNIT = 10_000_000
 
 DAILY_REWARD_PER_POOL = Decimal("4000")
-HOURLY_REWARD_PER_POOL = DAILY_REWARD_PER_POOL / Decimal("24")
+# The hourly reward (daily / 24) is not a whole number of stroops, so keep it as a fraction
+_HOURLY_NUMERATOR = int(DAILY_REWARD_PER_POOL * STROOPS_PER_UNIT)
+_HOURLY_DENOMINATOR = 24
+
+
+def _to_stroops(value: Any) -> int:
+    # Horizon amounts are plain decimal strings; shift the point instead of building a Decimal
+    text = str(value)
+    whole, _, frac = text.partition(".")
+    try:
+        return int(whole + frac[:7].ljust(7, "0"))
+    except ValueError:
+        return int((Decimal(text) * STROOPS_PER_UNIT).to_integral_value(rounding=ROUND_DOWN))
+
+
+def _format_stroops(stroops: int) -> str:
+    return f"{stroops // STROOPS_PER_UNIT}.{stroops % STROOPS_PER_UNIT:07d}"
 
 
 def compute_percentages_and_hourly(snapshot: Dict[str, Any]) -> List[Dict[str, Any]]:
-    total_shares = Decimal(str(snapshot["total_shares"]))
+    total_shares = _to_stroops(snapshot["total_shares"])
+    hourly_denominator = _HOURLY_DENOMINATOR * total_shares
     outputs: List[Dict[str, Any]] = []
 
     for rec in snapshot["records"]:
-        balance = Decimal(str(rec["balance"]))
-        percent = (balance / total_shares) if total_shares > 0 else Decimal("0")
-        hourly = (HOURLY_REWARD_PER_POOL * percent).quantize(Decimal("0.0000001"), rounding=ROUND_DOWN)
+        balance = _to_stroops(rec["balance"])
+        if total_shares > 0:
+            # floor(hourly * balance / total) and floor(100 * balance / total), both to 7 decimals
+            hourly = _HOURLY_NUMERATOR * balance // hourly_denominator
+            percent = balance * 100 * STROOPS_PER_UNIT // total_shares
+        else:
+            hourly = percent = 0
         outputs.append(
             {
                 "account": rec["account"],
-                "balance": str(balance),
-                "percent": str((percent * Decimal("100")).quantize(Decimal("0.0000001"), rounding=ROUND_DOWN)),
-                "hourly_amount_lmnr": str(hourly),
+                "balance": str(rec["balance"]),
+                "percent": _format_stroops(percent),
+                "hourly_amount_lmnr": _format_stroops(hourly),
             }
         )
 
     return outputs
-
-
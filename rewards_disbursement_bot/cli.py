@@ -1,7 +1,8 @@
 import asyncio
-import json
+import orjson
 import logging
 from argparse import ArgumentParser
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Any, List
 
@@ -12,7 +13,7 @@ from .logging_setup import setup_logging
 from .horizon_client import HorizonClient
 from .expert_client import StellarExpertClient
 from .discovery import discover_pools_for_lmnr
-from .participants import snapshot_participants_for_pool
+from .participants import snapshot_many
 from .state import PoolsMap, read_participants_snapshot, write_payout_record, iso_date_utc
 from .calculator import compute_percentages_and_hourly
 
@@ -24,14 +25,14 @@ async def signer_noop(xdr: str) -> str:
 async def cmd_discover(args) -> None:
     cfg = load_config()
     pools_map = PoolsMap(cfg.data_dir / "pools.json")
-    horizon = HorizonClient(cfg.horizon_url)
-    await discover_pools_for_lmnr(
-        horizon,
-        cfg.lmnr_code,
-        cfg.lmnr_issuer,
-        pools_map,
-        rebuild=bool(getattr(args, "rebuild", False)),
-    )
+    async with HorizonClient(cfg.horizon_url) as horizon:
+        await discover_pools_for_lmnr(
+            horizon,
+            cfg.lmnr_code,
+            cfg.lmnr_issuer,
+            pools_map,
+            rebuild=bool(getattr(args, "rebuild", False)),
+        )
 
 
 async def cmd_snapshot(args) -> None:
@@ -41,7 +42,6 @@ async def cmd_snapshot(args) -> None:
     if not mapping:
         print("No pools in pools.json. Run discover first.")
         return
-    expert = StellarExpertClient(cfg.network_label)
     # Allow narrowing to a single pool via arg for testing
     target_pool_id = getattr(args, "pool_id", None)
     max_pools = getattr(args, "max_pools", None)
@@ -51,19 +51,35 @@ async def cmd_snapshot(args) -> None:
         if not items:
             print(f"Pool id {target_pool_id} not found in pools.json")
             return
-    count = 0
+    # pools.json maps each pool under both "X-LMNR" and "LMNR-X"; snapshot each pool_id once
+    unique_items: Dict[str, str] = {}
     for label, pool_id in items:
-        if max_pools and count >= int(max_pools):
-            break
-        try:
-            print(f"Snapshotting {label} ({pool_id})...")
-            await snapshot_participants_for_pool(expert, cfg.data_dir, pool_id)
-            count += 1
-            # polite pause between pools to avoid rate limits
-            await asyncio.sleep(cfg.snapshot_pool_pause_seconds)
-        except Exception as e:
-            logging.error("Snapshot failed for %s (%s): %s", label, pool_id, str(e))
-            # continue to next
+        unique_items.setdefault(pool_id, label)
+    items = [(label, pool_id) for pool_id, label in unique_items.items()]
+    if max_pools:
+        items = items[:int(max_pools)]
+
+    print(f"Snapshotting {len(items)} pools (up to {max(1, cfg.snapshot_concurrency)} at a time)...")
+    async with StellarExpertClient(cfg.network_label) as expert:
+        results = await snapshot_many(
+            expert,
+            cfg.data_dir,
+            [pool_id for _, pool_id in items],
+            cfg.snapshot_concurrency,
+            pause_seconds=cfg.snapshot_pool_pause_seconds,
+        )
+    for (label, pool_id), result in zip(items, results):
+        if isinstance(result, Exception):
+            logging.error("Snapshot failed for %s (%s): %s", label, pool_id, str(result))
+
+
+@lru_cache(maxsize=256)
+def human_readable_memo(label: str) -> str:
+    # Convert "USDC:ISSUER-LMNR" -> "USDC LMNR LP"; keep only codes, drop issuers
+    codes = [p.split(":", 1)[0] for p in label.split("-")]
+    memo = " ".join(codes) + " LP"
+    # Stellar text memo max 28 bytes
+    return memo[:28]
 
 
 async def cmd_payout(args) -> None:
@@ -75,19 +91,10 @@ async def cmd_payout(args) -> None:
         print("No pools in pools.json. Run discover first.")
         return
 
-    def human_readable_memo(label: str) -> str:
-        # Convert "USDC:ISSUER-LMNR" -> "USDC LMNR LP"; keep only codes, drop issuers
-        parts = label.split("-")
-        codes = []
-        for p in parts:
-            code = p.split(":", 1)[0]
-            codes.append(code)
-        memo = " ".join(codes) + " LP"
-        # Stellar text memo max 28 bytes
-        return memo[:28]
-
     # Build app context adapter for transaction submission
     client = AiohttpClient()
+    # Ledger files are written on worker threads so the next pool's submissions don't wait on disk
+    ledger_writes: List[asyncio.Task] = []
     try:
         signer = None if cfg.disbursement_secret else signer_noop
         ctx = AppContextAdapter(
@@ -100,13 +107,15 @@ async def cmd_payout(args) -> None:
         )
 
         date_str = iso_date_utc()
-        seen_pool_ids = set()
+        # Avoid processing the same pool_id twice when multiple labels map to it; first label wins
+        unique_pools: Dict[str, str] = {}
         for label, pool_id in mapping.items():
-            # Avoid processing the same pool_id twice when multiple labels map to it
-            if pool_id in seen_pool_ids:
+            if pool_id in unique_pools:
                 logging.info("Skipping duplicate pool_id already processed: %s (%s)", pool_id, label)
                 continue
-            seen_pool_ids.add(pool_id)
+            unique_pools[pool_id] = label
+
+        for pool_id, label in unique_pools.items():
             snapshot = read_participants_snapshot(cfg.data_dir, pool_id)
             if not snapshot or not snapshot.get("records"):
                 logging.warning("No snapshot for pool %s (%s), skip.", label, pool_id)
@@ -119,8 +128,10 @@ async def cmd_payout(args) -> None:
                     {"account": p["account"], "hourly_amount_lmnr": p["hourly_amount_lmnr"]}
                     for p in payouts[:10]
                 ]
-                print(f"[DRY-RUN] {label} ({pool_id}) first 10 payouts:", json.dumps(preview, indent=2))
-                write_payout_record(cfg.data_dir, date_str, pool_id, payouts)
+                print(f"[DRY-RUN] {label} ({pool_id}) first 10 payouts:", orjson.dumps(preview, option=orjson.OPT_INDENT_2).decode())
+                ledger_writes.append(asyncio.create_task(
+                    asyncio.to_thread(write_payout_record, cfg.data_dir, date_str, pool_id, payouts)
+                ))
                 continue
 
             # Placeholder db_pool for compatibility with core.stellar signature
@@ -149,8 +160,13 @@ async def cmd_payout(args) -> None:
                         "response": resp,
                     }
                 )
-            write_payout_record(cfg.data_dir, date_str, pool_id, records)
+            ledger_writes.append(asyncio.create_task(
+                asyncio.to_thread(write_payout_record, cfg.data_dir, date_str, pool_id, records)
+            ))
     finally:
+        for result in await asyncio.gather(*ledger_writes, return_exceptions=True):
+            if isinstance(result, Exception):
+                logging.error("Failed to write payout ledger: %s", str(result))
         # ensure aiohttp client is closed to avoid warnings
         try:
             await client.close()
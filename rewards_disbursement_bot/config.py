@@ -1,10 +1,11 @@
 import os
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 from dotenv import load_dotenv
 
 
-@dataclass
+@dataclass(frozen=True)
 class AppConfig:
     horizon_url: str
     network_passphrase: str
@@ -16,6 +17,8 @@ class AppConfig:
     snapshot_page_limit: int
     snapshot_request_delay_seconds: float
     snapshot_min_retry_after_seconds: float
+    expert_overview_ttl_seconds: float
+    expert_holders_ttl_seconds: float
     max_ops_per_tx: int
     submit_sleep_seconds: float
     max_submit_retries: int
@@ -29,7 +32,9 @@ class AppConfig:
     network_label: str
 
 
+@lru_cache(maxsize=1)
 def load_config() -> AppConfig:
+    # Loaded once per process; every caller shares the same (immutable) config
     load_dotenv(override=True)
 
     data_dir = Path(os.getenv("DATA_DIR", "data")).resolve()
@@ -56,6 +61,8 @@ def load_config() -> AppConfig:
         snapshot_page_limit=int(os.getenv("SNAPSHOT_PAGE_LIMIT", "50")),
         snapshot_request_delay_seconds=float(os.getenv("SNAPSHOT_REQUEST_DELAY_SECONDS", "0.5")),
         snapshot_min_retry_after_seconds=float(os.getenv("SNAPSHOT_MIN_RETRY_AFTER_SECONDS", "5.0")),
+        expert_overview_ttl_seconds=float(os.getenv("EXPERT_OVERVIEW_TTL_SECONDS", "300")),
+        expert_holders_ttl_seconds=float(os.getenv("EXPERT_HOLDERS_TTL_SECONDS", "600")),
         max_ops_per_tx=int(os.getenv("MAX_OPS_PER_TX", "100")),
         submit_sleep_seconds=float(os.getenv("SUBMIT_SLEEP_SECONDS", "2")),
         max_submit_retries=int(os.getenv("MAX_SUBMIT_RETRIES", "5")),
@@ -1,6 +1,8 @@
 from typing import Dict, List, Tuple
 import logging
 
+from yarl import URL
+
 from .horizon_client import HorizonClient
 from .state import PoolsMap
 from .config import load_config
@@ -26,6 +28,20 @@ def reserve_label(code: str | None, issuer: str | None) -> str:
     return code
 
 
+def asset_str(r: dict) -> str | None:
+    if "asset" in r and r["asset"]:
+        return r["asset"]
+    # fallback to older/hybrid representations
+    a_type = r.get("asset_type")
+    if a_type == "native":
+        return "native"
+    code = r.get("asset_code")
+    issuer = r.get("asset_issuer")
+    if code and issuer:
+        return f"{code}:{issuer}"
+    return None
+
+
 async def discover_pools_for_lmnr(
         horizon: HorizonClient,
         lmnr_code: str,
@@ -46,40 +62,26 @@ async def discover_pools_for_lmnr(
     page = 0
     cfg = load_config()
     max_pages = max(1, int(getattr(cfg, "max_discovery_pages", 100)))
+    lmnr_key = f"{lmnr_code}:{lmnr_issuer}"
 
     import aiohttp
-    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=40)) as session:
+    async with horizon.session_scope(timeout=aiohttp.ClientTimeout(total=40)) as session:
         while True:
             page += 1
             data = await horizon.list_liquidity_pools(limit=200, cursor=cursor, order="asc", session=session)
             records = data.get("_embedded", {}).get("records", [])
             total_seen += len(records)
             logger.info("Discovery scanning page %d, %d records (total seen %d)", page, len(records), total_seen)
-            for rec in records:
-                pool_id = rec.get("id")
-                reserves = rec.get("reserves", [])
-                if not pool_id or len(reserves) != 2:
+            # One pass extracts (pool id, asset, asset) per two-reserve pool; the match loop below
+            # then only compares strings. Assets are "native" or "CODE:ISSUER".
+            rows = [
+                (rec.get("id"), asset_str(reserves[0]), asset_str(reserves[1]))
+                for rec in records
+                if len(reserves := rec.get("reserves", ())) == 2
+            ]
+            for pool_id, a0, a1 in rows:
+                if not pool_id:
                     continue
-                # Identify if this pool contains LMNR based on 'asset' string ("native" or "CODE:ISSUER")
-                r0, r1 = reserves[0], reserves[1]
-
-                def asset_str(r: dict) -> str | None:
-                    if "asset" in r and r["asset"]:
-                        return r["asset"]
-                    # fallback to older/hybrid representations
-                    a_type = r.get("asset_type")
-                    if a_type == "native":
-                        return "native"
-                    code = r.get("asset_code")
-                    issuer = r.get("asset_issuer")
-                    if code and issuer:
-                        return f"{code}:{issuer}"
-                    return None
-
-                a0 = asset_str(r0)
-                a1 = asset_str(r1)
-                lmnr_key = f"{lmnr_code}:{lmnr_issuer}"
-
                 if a0 == lmnr_key:
                     other_asset = a1
                 elif a1 == lmnr_key:
@@ -96,21 +98,14 @@ async def discover_pools_for_lmnr(
                 label = f"{other_label}-{lmnr_code}"
                 rev = f"{lmnr_code}-{other_label}"
                 # Always set/overwrite to ensure stale IDs are corrected
-                prev = updated.get(label)
-                if prev != pool_id:
-                    updated[label] = pool_id
-                prev_rev = updated.get(rev)
-                if prev_rev != pool_id:
-                    updated[rev] = pool_id
+                updated[label] = pool_id
+                updated[rev] = pool_id
 
             # pagination
             next_href = data.get("_links", {}).get("next", {}).get("href")
-            if not next_href or "cursor=" not in next_href:
+            cursor = URL(next_href).query.get("cursor") if next_href else None
+            if not cursor:
                 break
-            cursor_val = next_href.split("cursor=", 1)[1]
-            if "&" in cursor_val:
-                cursor_val = cursor_val.split("&", 1)[0]
-            cursor = cursor_val
 
             if page >= max_pages:
                 logger.warning("Stopping discovery after %d pages (safety cap).", max_pages)
@@ -1,28 +1,108 @@
+from contextlib import asynccontextmanager
 from typing import Dict, List, Optional, Tuple
 import aiohttp
 import logging
+from yarl import URL
 import asyncio
-import random
+import time
 
 from .config import load_config
+from .rate_limit import AdaptiveTokenBucket
 
 
 logger = logging.getLogger(__name__)
 
 
 class StellarExpertClient:
-    def __init__(self, network_label: str = "public") -> None:
+    def __init__(self, network_label: str = "public", session: aiohttp.ClientSession | None = None) -> None:
         self.network_label = network_label
         self.base_url = f"https://api.stellar.expert/explorer/{self.network_label}"
+        self.session = session
+        self._owns_session = False
+        cfg = load_config()
+        req_delay = max(0.0, float(cfg.snapshot_request_delay_seconds))
+        self.min_retry_after = max(0.0, float(cfg.snapshot_min_retry_after_seconds))
+        # One bucket for every Stellar Expert call from this client, so concurrent pool
+        # snapshots converge on the API's admission rate together instead of each backing off alone
+        base_rate = 1.0 / req_delay if req_delay else 20.0
+        self.bucket = AdaptiveTokenBucket(rate=base_rate, max_rate=2 * base_rate)
+        # Entries hold the fetch task: concurrent callers for a pool always share the in-flight
+        # request, and a finished result is reused until its TTL lapses
+        self.overview_ttl = cfg.expert_overview_ttl_seconds
+        self.holders_ttl = cfg.expert_holders_ttl_seconds
+        self._overview_cache: Dict[str, Tuple[float, asyncio.Task]] = {}
+        self._holders_cache: Dict[str, Tuple[float, asyncio.Task]] = {}
+
+    async def __aenter__(self) -> "StellarExpertClient":
+        # Without an injected session, hold one keep-alive pool for this host until exit
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=60)
+            )
+            self._owns_session = True
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        if self._owns_session:
+            await self.session.close()
+            self.session = None
+            self._owns_session = False
+
+    @asynccontextmanager
+    async def session_scope(self, **session_kwargs):
+        """Yield the shared session given at construction, or a throwaway one if there is none."""
+        if self.session is not None:
+            yield self.session
+        else:
+            async with aiohttp.ClientSession(**session_kwargs) as session:
+                yield session
 
-    async def get_pool_overview(self, pool_id: str) -> Dict:
-        url = f"{self.base_url}/liquidity-pool/{pool_id}"
+    def _retry_after_seconds(self, value: str | None) -> float:
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            return self.min_retry_after
+
+    async def _get_json(self, session: aiohttp.ClientSession, url: str, params=None, timeout=None) -> Dict:
+        """GET url through the shared bucket, retrying 429 and 5xx responses at the adapted rate."""
         headers = {"User-Agent": "photonbot-lp-rewards/1.0"}
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=40), headers=headers) as session:
-            async with session.get(url) as resp:
+        while True:
+            await self.bucket.acquire()
+            async with session.get(url, params=params, headers=headers, timeout=timeout) as resp:
+                if resp.status == 429:
+                    delay = self._retry_after_seconds(resp.headers.get("Retry-After"))
+                    self.bucket.decrease_rate(delay)
+                    logger.warning("429 from Stellar Expert, holding requests %.2fs (rate %.2f/s)", delay, self.bucket.rate)
+                    continue
+                if 500 <= resp.status < 600:
+                    self.bucket.decrease_rate()
+                    logger.warning("Expert 5xx (%d), retrying at %.2f req/s", resp.status, self.bucket.rate)
+                    continue
                 resp.raise_for_status()
+                self.bucket.increase_rate()
                 return await resp.json()
 
+    async def _cached(self, cache: Dict, key: str, ttl: float, fetch, force_refresh: bool = False):
+        now = time.monotonic()
+        entry = cache.get(key)
+        if entry is None or (entry[1].done() and (force_refresh or now - entry[0] >= ttl)):
+            entry = cache[key] = (now, asyncio.ensure_future(fetch()))
+        try:
+            # shield: one caller being cancelled must not cancel the fetch others are awaiting
+            return await asyncio.shield(entry[1])
+        except Exception:
+            if cache.get(key) is entry:
+                del cache[key]
+            raise
+
+    async def get_pool_overview(self, pool_id: str, force_refresh: bool = False) -> Dict:
+        async def fetch() -> Dict:
+            url = f"{self.base_url}/liquidity-pool/{pool_id}"
+            async with self.session_scope() as session:
+                return await self._get_json(session, url, timeout=aiohttp.ClientTimeout(total=40))
+
+        return await self._cached(self._overview_cache, pool_id, self.overview_ttl, fetch, force_refresh)
+
     async def get_pool_holders(
         self,
         pool_id: str,
@@ -31,110 +111,61 @@ class StellarExpertClient:
     ) -> Tuple[List[Dict], Optional[str]]:
         url = f"{self.base_url}/liquidity-pool/{pool_id}/holders"
         params = {"filter": "asset-holders", "limit": str(limit), "order": order}
-        headers = {"User-Agent": "photonbot-lp-rewards/1.0"}
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=40), headers=headers) as session:
-            async with session.get(url, params=params) as resp:
-                resp.raise_for_status()
-                data = await resp.json()
+        async with self.session_scope() as session:
+            data = await self._get_json(session, url, params=params, timeout=aiohttp.ClientTimeout(total=40))
+        records = data.get("_embedded", {}).get("records", [])
+        next_href = data.get("_links", {}).get("next", {}).get("href")
+        return records, next_href
+
+    async def _iter_pages(self, session: aiohttp.ClientSession, url: str, params=None, timeout=None):
+        """Yield holder records page by page.
+
+        The next page's href is only known once the current page is decoded, so the
+        request for it is issued before the current records are handed to the caller.
+        """
+        seen_hrefs = set()
+        next_task = asyncio.create_task(self._get_json(session, url, params=params, timeout=timeout))
+        try:
+            while next_task is not None:
+                data = await next_task
+                next_task = None
                 records = data.get("_embedded", {}).get("records", [])
+                logger.info("Expert holders received %d records (page)", len(records))
+                if not records:
+                    logger.info("No records on page; stopping pagination")
+                    return
                 next_href = data.get("_links", {}).get("next", {}).get("href")
-                return records, next_href
+                # guard against stuck pagination (an href repeating)
+                if not next_href or next_href in seen_hrefs:
+                    logger.info("Next href not present or not advancing; stopping pagination")
+                else:
+                    seen_hrefs.add(next_href)
+                    absolute = str(URL(url).join(URL(next_href)))
+                    logger.info("Expert holders request (next): %s", absolute)
+                    next_task = asyncio.create_task(self._get_json(session, absolute, timeout=timeout))
+                yield records
+        finally:
+            if next_task is not None:
+                next_task.cancel()
 
-    async def get_pool_holders_paginated(self, pool_id: str) -> List[Dict]:
-        headers = {"User-Agent": "photonbot-lp-rewards/1.0"}
+    async def get_pool_holders_paginated(self, pool_id: str, force_refresh: bool = False) -> List[Dict]:
+        return await self._cached(
+            self._holders_cache, pool_id, self.holders_ttl,
+            lambda: self._fetch_pool_holders_paginated(pool_id), force_refresh,
+        )
+
+    async def _fetch_pool_holders_paginated(self, pool_id: str) -> List[Dict]:
         timeout = aiohttp.ClientTimeout(total=60)
-        backoff = 1.0
-        max_backoff = 10.0
         all_records: List[Dict] = []
         cfg = load_config()
         page_limit = max(1, int(getattr(cfg, "snapshot_page_limit", 50)))
-        req_delay = max(0.0, float(getattr(cfg, "snapshot_request_delay_seconds", 0.5)))
-        min_retry_after = max(0.0, float(getattr(cfg, "snapshot_min_retry_after_seconds", 5.0)))
 
-        async with aiohttp.ClientSession(timeout=timeout, headers=headers) as session:
-            # First page
+        async with self.session_scope() as session:
             url = f"{self.base_url}/liquidity-pool/{pool_id}/holders"
             params = {"filter": "asset-holders", "limit": str(page_limit), "order": "desc"}
-            next_href: Optional[str] = None
-            while True:
-                try:
-                    # polite initial delay with jitter
-                    if req_delay:
-                        await asyncio.sleep(req_delay + random.uniform(0, req_delay))
-                    logger.info("Expert holders request (first page): pool=%s limit=%s order=desc", pool_id, page_limit)
-                    async with session.get(url, params=params, timeout=timeout) as resp:
-                        if resp.status == 429:
-                            retry_after = resp.headers.get("Retry-After")
-                            delay = float(retry_after) if retry_after else max(min_retry_after, backoff)
-                            logger.warning("429 from Stellar Expert, sleeping %.2fs", delay)
-                            await asyncio.sleep(delay)
-                            backoff = min(max_backoff, backoff * 1.5)
-                            continue
-                        resp.raise_for_status()
-                        data = await resp.json()
-                        recs = data.get("_embedded", {}).get("records", [])
-                        logger.info("Expert holders received %d records (first page)", len(recs))
-                        all_records.extend(recs)
-                        next_href = data.get("_links", {}).get("next", {}).get("href")
-                        break
-                except aiohttp.ClientResponseError as e:
-                    if 500 <= e.status < 600:
-                        logger.warning("Expert 5xx (%d), retrying in %.2fs", e.status, backoff)
-                        await asyncio.sleep(backoff)
-                        backoff = min(max_backoff, backoff * 1.5)
-                        continue
-                    raise
-
-            # Subsequent pages
-            last_href: Optional[str] = None
-            while next_href:
-                # guard against stuck pagination (same href repeating)
-                if last_href == next_href:
-                    logger.warning("Expert holders next href not advancing, stopping pagination: %s", next_href)
-                    break
-                absolute = f"https://api.stellar.expert{next_href}"
-                while True:
-                    try:
-                        if req_delay:
-                            await asyncio.sleep(req_delay + random.uniform(0, req_delay))
-                        logger.info("Expert holders request (next): %s", absolute)
-                        async with session.get(absolute, timeout=timeout) as resp:
-                            if resp.status == 429:
-                                retry_after = resp.headers.get("Retry-After")
-                                delay = float(retry_after) if retry_after else max(min_retry_after, backoff)
-                                logger.warning("429 from Stellar Expert (paged), sleeping %.2fs", delay)
-                                await asyncio.sleep(delay)
-                                backoff = min(max_backoff, backoff * 1.5)
-                                continue
-                            resp.raise_for_status()
-                            data = await resp.json()
-                            recs = data.get("_embedded", {}).get("records", [])
-                            logger.info("Expert holders received %d records (page)", len(recs))
-                            if not recs:
-                                logger.info("No records on page; stopping pagination")
-                                next_href = None
-                                break
-                            all_records.extend(recs)
-                            new_next = data.get("_links", {}).get("next", {}).get("href")
-                            if not new_next or new_next == next_href:
-                                logger.info("Next href not present or unchanged; stopping pagination")
-                                next_href = None
-                                break
-                            last_href = next_href
-                            next_href = new_next
-                            # extra tiny jitter after page
-                            if req_delay:
-                                await asyncio.sleep(random.uniform(0, req_delay))
-                            break
-                    except aiohttp.ClientResponseError as e:
-                        if 500 <= e.status < 600:
-                            logger.warning("Expert 5xx (%d) on page, retrying in %.2fs", e.status, backoff)
-                            await asyncio.sleep(backoff)
-                            backoff = min(max_backoff, backoff * 1.5)
-                            continue
-                        raise
+            logger.info("Expert holders request (first page): pool=%s limit=%s order=desc", pool_id, page_limit)
+            async for records in self._iter_pages(session, url, params=params, timeout=timeout):
+                all_records.extend(records)
 
         logger.info("Fetched %d holders for pool %s", len(all_records), pool_id)
         return all_records
-
-
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from typing import Dict, List, Optional
 import aiohttp
 import logging
@@ -7,8 +8,34 @@ logger = logging.getLogger(__name__)
 
 
 class HorizonClient:
-    def __init__(self, base_url: str) -> None:
+    def __init__(self, base_url: str, session: aiohttp.ClientSession | None = None) -> None:
         self.base_url = base_url.rstrip("/")
+        self.session = session
+        self._owns_session = False
+
+    async def __aenter__(self) -> "HorizonClient":
+        # Without an injected session, hold one keep-alive pool for this host until exit
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=60)
+            )
+            self._owns_session = True
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        if self._owns_session:
+            await self.session.close()
+            self.session = None
+            self._owns_session = False
+
+    @asynccontextmanager
+    async def session_scope(self, **session_kwargs):
+        """Yield the shared session given at construction, or a throwaway one if there is none."""
+        if self.session is not None:
+            yield self.session
+        else:
+            async with aiohttp.ClientSession(**session_kwargs) as session:
+                yield session
 
     async def list_liquidity_pools(
         self,
@@ -22,8 +49,8 @@ class HorizonClient:
             params["cursor"] = cursor
         url = f"{self.base_url}/liquidity_pools"
         if session is None:
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=40)) as _session:
-                async with _session.get(url, params=params) as resp:
+            async with self.session_scope() as _session:
+                async with _session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=40)) as resp:
                     resp.raise_for_status()
                     return await resp.json()
         else:
@@ -51,7 +78,7 @@ class HorizonClient:
 
         params["limit"] = str(limit)
         url = f"{self.base_url}/liquidity_pools"
-        async with aiohttp.ClientSession() as session:
+        async with self.session_scope() as session:
             async with session.get(url, params=params, timeout=30) as resp:
                 resp.raise_for_status()
                 data = await resp.json()
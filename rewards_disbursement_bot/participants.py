@@ -1,4 +1,5 @@
 from typing import Dict, List, Any
+import asyncio
 from datetime import datetime, timezone
 import logging
 
@@ -24,8 +25,32 @@ async def snapshot_participants_for_pool(
         "total_shares": str(total_shares) if total_shares is not None else None,
         "records": holders,
     }
-    write_participants_snapshot(base_dir, pool_id, payload)
+    # Other pools' snapshots are fetching concurrently; don't stall them on serialization and disk
+    await asyncio.to_thread(write_participants_snapshot, base_dir, pool_id, payload)
     logger.info("Wrote participants snapshot for %s with %d holders", pool_id, len(holders))
     return payload
 
 
+async def snapshot_many(
+    expert: StellarExpertClient,
+    base_dir,
+    pool_ids: List[str],
+    max_concurrency: int,
+    pause_seconds: float = 0.0,
+) -> List[Any]:
+    """
+    Snapshot pools with at most max_concurrency in flight. Returns a list aligned with
+    pool_ids holding each payload, or the exception that pool's snapshot raised.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def one(pool_id: str) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                return await snapshot_participants_for_pool(expert, base_dir, pool_id)
+            finally:
+                # polite pause before releasing the slot to avoid rate limits
+                if pause_seconds:
+                    await asyncio.sleep(pause_seconds)
+
+    return await asyncio.gather(*(one(pool_id) for pool_id in pool_ids), return_exceptions=True)
@@ -1,8 +1,10 @@
 from typing import List, Dict, Any, Tuple
 import logging
 import asyncio
+from collections import defaultdict
+from functools import lru_cache
 
-from stellar_sdk import Asset, Keypair, TransactionEnvelope
+from stellar_sdk import Asset, Keypair, MuxedAccount, TransactionEnvelope
 from stellar_sdk.operation import Payment
 
 from core.stellar import build_and_submit_transaction, wait_for_transaction_confirmation  # type: ignore
@@ -17,7 +19,12 @@ class AppContextAdapter:
     - horizon_url
     - client (aiohttp-like)
     - load_public_key(telegram_id)
-    - sign_transaction(telegram_id, xdr)
+    - load_signing_user(telegram_id)
+    - sign_transaction(telegram_id, xdr, user_data=None)
+    - fee_cache / fee_lock (shared recommended-fee memo)
+    - sequence_cache / sequence_locks (locally tracked account sequence)
+    - account_cache (short-lived account snapshots for display)
+    - confirm_semaphore (caps concurrent confirmation polls)
 
     For now, we assume DISBURSEMENT_PUBLIC/SECRET are loaded elsewhere and a signing
     path is provided. If a signing enclave isn't present, you can plug in direct
@@ -31,23 +38,41 @@ class AppContextAdapter:
         self._signer = signer
         self._network_passphrase = network_passphrase
         self._secret = disbursement_secret
+        self._keypair = None  # derived from _secret on first local signature
+        self.fee_cache = (0.0, None)
+        self.fee_lock = asyncio.Lock()
+        self.sequence_cache = {}
+        self.sequence_locks = defaultdict(asyncio.Lock)
+        self.account_cache = {}
+        self.confirm_semaphore = asyncio.Semaphore(20)
 
     async def load_public_key(self, _telegram_id):
         return self._public
 
-    async def sign_transaction(self, _telegram_id, xdr: str) -> str:
+    async def load_signing_user(self, _telegram_id):
+        return {"public_key": self._public}
+
+    async def sign_transaction(self, _telegram_id, xdr: str, user_data=None) -> str:
         # Prefer injected signer callback if provided
         if self._signer:
             return await self._signer(xdr)
         # Fallback: sign locally with DISBURSEMENT_SECRET if available
         if not self._secret or not self._network_passphrase:
             raise RuntimeError("No signer configured. Provide signer callback or DISBURSEMENT_SECRET + network_passphrase.")
-        kp = Keypair.from_secret(self._secret)
+        if self._keypair is None:
+            self._keypair = Keypair.from_secret(self._secret)
+        kp = self._keypair
         envelope = TransactionEnvelope.from_xdr(xdr, self._network_passphrase)
         envelope.sign(kp)
         return envelope.to_xdr()
 
 
+@lru_cache(maxsize=10_000)
+def destination_account(account: str) -> MuxedAccount:
+    # The same LP holders are paid every hour; validate and parse each strkey once per process
+    return MuxedAccount.from_account(account)
+
+
 async def build_lmnr_payments(
     payouts: List[Dict[str, Any]],
     lmnr_code: str,
@@ -58,7 +83,7 @@ async def build_lmnr_payments(
     for item in payouts:
         amount = item["hourly_amount_lmnr"]
         dest = item["account"]
-        ops.append(Payment(destination=dest, asset=asset, amount=str(amount)))
+        ops.append(Payment(destination=destination_account(dest), asset=asset, amount=str(amount)))
     return ops
 
 
@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+
+class AdaptiveTokenBucket:
+    """Token bucket whose refill rate adapts to the server's admission rate.
+
+    Each success raises the rate additively (by increment, up to max_rate); each
+    rejection divides it by decrease_factor (down to min_rate). A Retry-After from
+    the server holds every caller sharing the bucket, not just the one that got it.
+    """
+
+    def __init__(self, rate, max_rate, min_rate=0.1, capacity=2, increment=0.05, decrease_factor=2.0):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.capacity = capacity
+        self.increment = increment
+        self.decrease_factor = decrease_factor
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def increase_rate(self):
+        self.rate = min(self.max_rate, self.rate + self.increment)
+
+    def decrease_rate(self, hold_seconds=0.0):
+        self.rate = max(self.min_rate, self.rate / self.decrease_factor)
+        if hold_seconds > 0:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + hold_seconds)
@@ -1,10 +1,18 @@
-import json
+import os
+import orjson
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 
 
+def write_bytes_atomic(path: Path, data: bytes) -> None:
+    # Readers never see a half-written file: write a sibling temp file, then rename over the target
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
 @dataclass
 class PoolsMap:
     path: Path
@@ -12,13 +20,11 @@ class PoolsMap:
     def load(self) -> Dict[str, str]:
         if not self.path.exists():
             return {}
-        with self.path.open("r", encoding="utf-8") as f:
-            return json.load(f)
+        return orjson.loads(self.path.read_bytes())
 
     def save(self, mapping: Dict[str, str]) -> None:
         self.path.parent.mkdir(parents=True, exist_ok=True)
-        with self.path.open("w", encoding="utf-8") as f:
-            json.dump(mapping, f, indent=2, sort_keys=True)
+        write_bytes_atomic(self.path, orjson.dumps(mapping, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
 
 
 def participants_path(base_dir: Path, pool_id: str) -> Path:
@@ -28,16 +34,14 @@ def participants_path(base_dir: Path, pool_id: str) -> Path:
 def write_participants_snapshot(base_dir: Path, pool_id: str, payload: Dict[str, Any]) -> None:
     path = participants_path(base_dir, pool_id)
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
-        json.dump(payload, f, indent=2)
+    write_bytes_atomic(path, orjson.dumps(payload, option=orjson.OPT_INDENT_2))
 
 
 def read_participants_snapshot(base_dir: Path, pool_id: str) -> Optional[Dict[str, Any]]:
     path = participants_path(base_dir, pool_id)
     if not path.exists():
         return None
-    with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    return orjson.loads(path.read_bytes())
 
 
 def payout_ledger_dir(base_dir: Path, date_str: str) -> Path:
@@ -55,8 +59,7 @@ def write_payout_record(base_dir: Path, date_str: str, pool_id: str, records: Li
         "created_at": datetime.now(timezone.utc).isoformat(),
         "records": records,
     }
-    with path.open("w", encoding="utf-8") as f:
-        json.dump(payload, f, indent=2)
+    write_bytes_atomic(path, orjson.dumps(payload, option=orjson.OPT_INDENT_2))
     return path
 
 
@@ -6,7 +6,7 @@ from stellar_sdk.call_builder.call_builder_async import OperationsCallBuilder as
 from stellar_sdk.call_builder.call_builder_async import EffectsCallBuilder as AsyncEffectsCallBuilder
 from stellar_sdk.call_builder.call_builder_async import StrictSendPathsCallBuilder
 import logging
-from core.stellar import build_and_submit_transaction, has_trustline, load_account_async, parse_asset
+from core.stellar import build_and_submit_transaction, has_trustline, build_trustline_index, load_account_async, parse_asset
 from services.trade_services import wait_for_transaction_confirmation, calculate_fee_and_check_balance
 from services.referrals import log_xlm_volume, calculate_referral_shares
 
@@ -112,11 +112,13 @@ async def process_trade_signal(wallet, tx, chat_id, telegram_id, app_context):
                 dest_min_final = max(dest_min_final, round(min_acceptable, 7))
             
             fee = await calculate_fee_and_check_balance(app_context, None, send_asset, send_amount_final)  # No keypair needed
+            trustlines = build_trustline_index(account_dict)
             for asset in [send_asset, dest_asset]:
-                if not await has_trustline(account_dict, asset):
+                if not await has_trustline(account_dict, asset, index=trustlines):
                     logger.info(f"Adding trustline for {asset.code}")
                     operations_to_submit.append(ChangeTrust(asset=asset, limit="1000000000.0"))
                     account_dict = await load_account_async(await app_context.load_public_key(telegram_id), app_context)
+                    trustlines = build_trustline_index(account_dict)
             operations_to_submit.extend([
                 PathPaymentStrictSend(
                     destination=await app_context.load_public_key(telegram_id),
@@ -159,11 +161,13 @@ async def process_trade_signal(wallet, tx, chat_id, telegram_id, app_context):
                 dest_amount_final = round(dest_amount * (send_max_final / original_send_max), 7)
             
             fee = await calculate_fee_and_check_balance(app_context, None, send_asset, send_max_final)  # No keypair needed
+            trustlines = build_trustline_index(account_dict)
             for asset in [send_asset, dest_asset]:
-                if not await has_trustline(account_dict, asset):
+                if not await has_trustline(account_dict, asset, index=trustlines):
                     logger.info(f"Adding trustline for {asset.code}")
                     operations_to_submit.append(ChangeTrust(asset=asset, limit="1000000000.0"))
                     account_dict = await load_account_async(await app_context.load_public_key(telegram_id), app_context)
+                    trustlines = build_trustline_index(account_dict)
             operations_to_submit.extend([
                 PathPaymentStrictReceive(
                     destination=await app_context.load_public_key(telegram_id),
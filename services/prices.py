@@ -3,10 +3,8 @@ import asyncio
 import redis.asyncio as redis
 from stellar_sdk import Asset, scval, Network
 from stellar_sdk.contract.contract_client_async import ContractClientAsync
-from stellar_sdk.soroban_server_async import SorobanServerAsync
 from stellar_sdk.call_builder.call_builder_async import OrderbookCallBuilder as AsyncOrderbookCallBuilder
 from stellar_sdk.call_builder.call_builder_async.strict_receive_paths_call_builder import StrictReceivePathsCallBuilder
-from stellar_sdk.client.aiohttp_client import AiohttpClient
 from aiohttp_client_cache import CachedSession
 from tenacity import retry, stop_after_attempt, wait_exponential
 import logging
@@ -51,71 +49,66 @@ async def get_asset_price(
     source_account = user_public_key or app_context.fee_wallet
 
     # Use the free mainnet RPC endpoint
-    rpc_url = "https://mainnet.sorobanrpc.com"
-    client = AiohttpClient()
-    async with client:
-        soroban_server = SorobanServerAsync(rpc_url, client=client)
-        try:
-            # Construct the ContractClientAsync with the standalone server
-            contract_client = ContractClientAsync(
-                contract_id=contract_id,
-                rpc_url=rpc_url,
-                network_passphrase=NETWORK_PASSPHRASE,
-                request_client=client
-            )
+    rpc_url = app_context.soroban_rpc_url
+    client = app_context.soroban_client  # shared keep-alive pool, closed by AppContext.shutdown
+    try:
+        # Construct the ContractClientAsync on the shared RPC client; no `async with`, which would close it
+        contract_client = ContractClientAsync(
+            contract_id=contract_id,
+            rpc_url=rpc_url,
+            network_passphrase=NETWORK_PASSPHRASE,
+            request_client=client
+        )
 
-            async with contract_client:
-                # Construct the Stellar asset parameter using a dict
-                asset_struct = scval.to_struct({
-                    "code": scval.to_string(asset_code),
-                    "issuer": scval.to_address(issuer)
-                })
-                params = [scval.to_enum("Stellar", asset_struct)]
+        # Construct the Stellar asset parameter using a dict
+        asset_struct = scval.to_struct({
+            "code": scval.to_string(asset_code),
+            "issuer": scval.to_address(issuer)
+        })
+        params = [scval.to_enum("Stellar", asset_struct)]
 
-                # Invoke lastprice
-                assembled_tx = await contract_client.invoke(
-                    function_name="lastprice",
-                    parameters=params,
-                    source=source_account,
-                    parse_result_xdr_fn=lambda v: v
-                )
+        # Invoke lastprice
+        assembled_tx = await contract_client.invoke(
+            function_name="lastprice",
+            parameters=params,
+            source=source_account,
+            parse_result_xdr_fn=lambda v: v
+        )
 
-                # Simulate and parse result
-                result = await assembled_tx.simulate()
-                if not result.results or len(result.results) == 0:
-                    logger.warning(f"Reflector: No price for {asset_code}:{issuer}")
-                    raise ValueError("No result from lastprice")
+        # Simulate and parse result
+        result = await assembled_tx.simulate()
+        if not result.results or len(result.results) == 0:
+            logger.warning(f"Reflector: No price for {asset_code}:{issuer}")
+            raise ValueError("No result from lastprice")
 
-                # Parse PriceData struct: { price: i128, timestamp: u64 }
-                price_data = scval.from_scval(result.results[0].xdr)
-                if not price_data.is_struct():
-                    logger.warning(f"Reflector: Invalid price data for {asset_code}:{issuer}")
-                    raise ValueError("Invalid price data format")
+        # Parse PriceData struct: { price: i128, timestamp: u64 }
+        price_data = scval.from_scval(result.results[0].xdr)
+        if not price_data.is_struct():
+            logger.warning(f"Reflector: Invalid price data for {asset_code}:{issuer}")
+            raise ValueError("Invalid price data format")
 
-                price_struct = price_data.struct
-                price = price_struct["price"].to_int128()
-                # Fetch decimals to scale the price
-                decimals_tx = await contract_client.invoke(
-                    function_name="decimals",
-                    source=source_account,
-                    parse_result_xdr_fn=lambda v: v
-                )
-                decimals_result = await decimals_tx.simulate()
-                decimals = scval.from_scval(decimals_result.results[0].xdr).to_uint32()
+        price_struct = price_data.struct
+        price = price_struct["price"].to_int128()
+        # Fetch decimals to scale the price
+        decimals_tx = await contract_client.invoke(
+            function_name="decimals",
+            source=source_account,
+            parse_result_xdr_fn=lambda v: v
+        )
+        decimals_result = await decimals_tx.simulate()
+        decimals = scval.from_scval(decimals_result.results[0].xdr).to_uint32()
 
-                price_float = price / (10 ** decimals)
-                if redis_client:
-                    try:
-                        await redis_client.setex(cache_key, 10, price_float)
-                    except Exception as e:
-                        logger.warning(f"Redis cache set failed: {e}. Continuing without cache.")
-                logger.info(f"Reflector price for {asset_code}:{issuer}: {price_float} XLM")
-                return price_float
+        price_float = price / (10 ** decimals)
+        if redis_client:
+            try:
+                await redis_client.setex(cache_key, 10, price_float)
+            except Exception as e:
+                logger.warning(f"Redis cache set failed: {e}. Continuing without cache.")
+        logger.info(f"Reflector price for {asset_code}:{issuer}: {price_float} XLM")
+        return price_float
 
-        except Exception as e:
-            logger.error(f"Reflector failed for {asset_code}:{issuer} with RPC {rpc_url}: {e}")
-        finally:
-            await soroban_server.close()
+    except Exception as e:
+        logger.error(f"Reflector failed for {asset_code}:{issuer} with RPC {rpc_url}: {e}")
 
     # Fallback to order book using path-based check
     try:
@@ -247,36 +240,31 @@ async def get_supported_assets(app_context) -> List[Tuple[str, str]]:
     source_account = app_context.fee_wallet
 
     # Use the free mainnet RPC endpoint
-    rpc_url = "https://mainnet.sorobanrpc.com"
-    client = AiohttpClient()
-    async with client:
-        soroban_server = SorobanServerAsync(rpc_url, client=client)
-        try:
-            contract_client = ContractClientAsync(
-                contract_id=contract_id,
-                rpc_url=rpc_url,
-                network_passphrase=NETWORK_PASSPHRASE,
-                request_client=client
-            )
+    rpc_url = app_context.soroban_rpc_url
+    client = app_context.soroban_client  # shared keep-alive pool, closed by AppContext.shutdown
+    try:
+        contract_client = ContractClientAsync(
+            contract_id=contract_id,
+            rpc_url=rpc_url,
+            network_passphrase=NETWORK_PASSPHRASE,
+            request_client=client
+        )
 
-            async with contract_client:
-                assembled_tx = await contract_client.invoke(
-                    function_name="assets",
-                    source=source_account,
-                    parse_result_xdr_fn=lambda v: v
-                )
-                result = await assembled_tx.simulate()
-                assets = scval.from_scval(result.results[0].xdr).to_vec()
-                supported_assets = []
-                for asset in assets:
-                    code = asset.struct["code"].string.decode()
-                    issuer_scval = asset.struct["issuer"]
-                    issuer = issuer_scval.address.account_id.account_id.decode()
-                    supported_assets.append((code, issuer))
-                logger.info(f"Supported assets by Reflector: {supported_assets}")
-                return supported_assets
-        except Exception as e:
-            logger.error(f"Failed to fetch supported assets from Reflector with RPC {rpc_url}: {e}")
-            return []
-        finally:
-            await soroban_server.close()
\ No newline at end of file
+        assembled_tx = await contract_client.invoke(
+            function_name="assets",
+            source=source_account,
+            parse_result_xdr_fn=lambda v: v
+        )
+        result = await assembled_tx.simulate()
+        assets = scval.from_scval(result.results[0].xdr).to_vec()
+        supported_assets = []
+        for asset in assets:
+            code = asset.struct["code"].string.decode()
+            issuer_scval = asset.struct["issuer"]
+            issuer = issuer_scval.address.account_id.account_id.decode()
+            supported_assets.append((code, issuer))
+        logger.info(f"Supported assets by Reflector: {supported_assets}")
+        return supported_assets
+    except Exception as e:
+        logger.error(f"Failed to fetch supported assets from Reflector with RPC {rpc_url}: {e}")
+        return []
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import csv
 import os
@@ -10,6 +11,14 @@ logger = logging.getLogger(__name__)
 # Hardcode testnet network passphrase
 NETWORK_PASSPHRASE = "Public Global Stellar Network ; September 2015"
 
+# Hot on every trade; keep the text identical everywhere so asyncpg reuses one cached prepared statement
+REFERRER_QUERY = "SELECT referrer_id FROM referrals WHERE referee_id = $1"
+
+async def prepare_hot_statements(conn):
+    """Pool init hook: prepare the per-trade referrer lookup into the connection's statement cache."""
+    # Connection.prepare() bypasses the statement cache, so run the query once to populate it
+    await conn.fetchval(REFERRER_QUERY, 0)
+
 async def log_xlm_volume(user_id, xlm_volume, tx_hash=None, db_pool=None):
     async with db_pool.acquire() as conn:
         if tx_hash:
@@ -31,10 +40,7 @@ async def calculate_referral_shares(db_pool_copytrading, user_id, fee):
         referrer_chain = []
         current_user = user_id
         for _ in range(5):  # Up to 5 levels of referrals
-            referrer = await conn.fetchval(
-                "SELECT referrer_id FROM referrals WHERE referee_id = $1",
-                current_user
-            )
+            referrer = await conn.fetchval(REFERRER_QUERY, current_user)
             if not referrer:
                 break
             referrer_chain.append(referrer)
@@ -86,46 +92,53 @@ async def export_unpaid_rewards(db_pool_nitro, db_pool_copytrading, output_file)
         - total_payout: Total amount to be paid out (float).
         - payout_list: List of (user_id, public_key, amount) tuples for the payout.
     """
-    async with db_pool_copytrading.acquire() as conn:
-        rewards = await conn.fetch("""
-            SELECT user_id, SUM(amount) AS total_amount
-            FROM rewards
-            WHERE status = 'unpaid'
-            GROUP BY user_id
-            HAVING SUM(amount) >= 0.1  -- Minimum payout threshold of 0.1 XLM
-        """)
-
-        if not rewards:
-            logger.info("No unpaid rewards found to export.")
-            return None, 0, []
-
-        # Calculate total payout amount and prepare payout list
-        total_payout = 0
-        payout_list = []
-        async with db_pool_nitro.acquire() as conn_nitro:
-            for row in rewards:
-                user_id = row['user_id']
-                amount = float(row['total_amount'])  # Convert Decimal to float
-                public_key = await conn_nitro.fetchval(
-                    "SELECT public_key FROM users WHERE telegram_id = $1", user_id
-                )
-                if public_key:
-                    total_payout += amount
-                    payout_list.append((user_id, public_key, amount))
-                else:
-                    logger.warning(f"No public key found for user {user_id}, skipping payout")
-
-        # Export to CSV for record-keeping
-        with open(output_file, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['user_id', 'public_key', 'amount'])
-            for user_id, public_key, amount in payout_list:
-                writer.writerow([user_id, public_key, amount])
-
-        logger.info(f"Exported unpaid rewards to {output_file} with total payout {total_payout:.7f} XLM")
-        return output_file, total_payout, payout_list
-
-async def daily_payout(db_pool_nitro, db_pool_copytrading, bot, chat_id, app_context):
+    rewards = await db_pool_copytrading.fetch("""
+        SELECT user_id, SUM(amount) AS total_amount
+        FROM rewards
+        WHERE status = 'unpaid'
+        GROUP BY user_id
+        HAVING SUM(amount) >= 0.1  -- Minimum payout threshold of 0.1 XLM
+    """)
+
+    if not rewards:
+        logger.info("No unpaid rewards found to export.")
+        return None, 0, []
+
+    # Resolve every payee's public key in one round trip instead of one query per user
+    users = await db_pool_nitro.fetch(
+        "SELECT telegram_id, public_key FROM users WHERE telegram_id = ANY($1::bigint[])",
+        [row['user_id'] for row in rewards]
+    )
+    public_keys = {row['telegram_id']: row['public_key'] for row in users}
+
+    # Calculate total payout amount and prepare payout list
+    total_payout = 0
+    payout_list = []
+    for row in rewards:
+        user_id = row['user_id']
+        amount = float(row['total_amount'])  # Convert Decimal to float
+        public_key = public_keys.get(user_id)
+        if public_key:
+            total_payout += amount
+            payout_list.append((user_id, public_key, amount))
+        else:
+            logger.warning(f"No public key found for user {user_id}, skipping payout")
+
+    # Export to CSV for record-keeping
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['user_id', 'public_key', 'amount'])
+        writer.writerows(payout_list)
+
+    logger.info(f"Exported unpaid rewards to {output_file} with total payout {total_payout:.7f} XLM")
+    return output_file, total_payout, payout_list
+
+async def daily_payout(db_pool_nitro, db_pool_copytrading, bot, chat_id, app_context, deadline=None):
+    """Pay out unpaid referral rewards in batches of up to 100 payments.
+
+    deadline is an event-loop time; once it has passed no further batch is started. A batch
+    in progress always finishes, so a submitted payment is never left marked unpaid.
+    """
     output_file = f"referral_rewards_export_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"
     exported_file, total_payout, payout_list = await export_unpaid_rewards(db_pool_nitro, db_pool_copytrading, output_file)
 
@@ -156,37 +169,39 @@ async def daily_payout(db_pool_nitro, db_pool_copytrading, bot, chat_id, app_con
     async with db_pool_copytrading.acquire() as conn:
         successful_payouts = 0
         failed_payouts = 0
-        operations = []
+        deferred_payouts = 0
         batch_size = 100
+        loop = asyncio.get_running_loop()
 
-        for i, (user_id, public_key, amount) in enumerate(payout_list):
-            rounded_amount = round(amount, 7)
-            operations.append(Payment(
-                destination=public_key,
-                asset=Asset.native(),
-                amount=str(rounded_amount)
-            ))
-
-            if len(operations) == batch_size or i == len(payout_list) - 1:
-                try:
-                    response, _ = await build_and_submit_transaction(
-                        fee_telegram_id,
-                        db_pool_nitro,
-                        operations,
-                        app_context,
-                        memo="Referral Payout"
-                    )
-                    for user_id, _, _ in payout_list[i - len(operations) + 1:i + 1]:
-                        await conn.execute(
-                            "UPDATE rewards SET status = 'paid', paid_at = CURRENT_TIMESTAMP WHERE user_id = $1 AND status = 'unpaid'",
-                            user_id
-                        )
-                    successful_payouts += len(operations)
-                    logger.info(f"Batch payout successful: {response['hash']}")
-                except Exception as e:
-                    logger.error(f"Batch payout failed: {str(e)}")
-                    failed_payouts += len(operations)
-                operations = []
+        for start in range(0, len(payout_list), batch_size):
+            if deadline is not None and loop.time() >= deadline:
+                deferred_payouts = len(payout_list) - start
+                logger.warning(f"Payout deadline reached, leaving {deferred_payouts} payouts unpaid for the next run")
+                break
+            batch = payout_list[start:start + batch_size]
+            operations = [
+                Payment(destination=public_key, asset=Asset.native(), amount=str(round(amount, 7)))
+                for _, public_key, amount in batch
+            ]
+            try:
+                response, _ = await build_and_submit_transaction(
+                    fee_telegram_id,
+                    db_pool_nitro,
+                    operations,
+                    app_context,
+                    memo="Referral Payout"
+                )
+                # One statement, so a batch's rewards are marked paid all together or not at all
+                await conn.execute(
+                    "UPDATE rewards SET status = 'paid', paid_at = CURRENT_TIMESTAMP "
+                    "WHERE user_id = ANY($1::bigint[]) AND status = 'unpaid'",
+                    [user_id for user_id, _, _ in batch]
+                )
+                successful_payouts += len(operations)
+                logger.info(f"Batch payout successful: {response['hash']}")
+            except Exception as e:
+                logger.error(f"Batch payout failed: {str(e)}")
+                failed_payouts += len(operations)
 
     if chat_id:
         message = (
@@ -195,6 +210,7 @@ async def daily_payout(db_pool_nitro, db_pool_copytrading, bot, chat_id, app_con
             f"Total Payout: {total_payout:.7f} XLM\n"
             f"Successful Payouts: {successful_payouts}\n"
             f"Failed Payouts: {failed_payouts}\n"
+            f"Deferred Payouts: {deferred_payouts}\n"
             f"Disbursement Wallet Balance After Payout: {fee_balance - total_payout:.7f} XLM"
         )
         await bot.send_message(chat_id, message)
\ No newline at end of file
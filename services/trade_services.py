@@ -1,8 +1,10 @@
 import logging
 import asyncio
+import random
 import time
 from decimal import Decimal
-from stellar_sdk import Asset, PathPaymentStrictReceive, PathPaymentStrictSend, ChangeTrust, Keypair, Payment
+from stellar_sdk import Asset, PathPaymentStrictReceive, PathPaymentStrictSend, ChangeTrust, Payment
+from stellar_sdk.strkey import StrKey
 from stellar_sdk.exceptions import NotFoundError
 from stellar_sdk.call_builder.call_builder_async import LedgersCallBuilder as AsyncLedgersCallBuilder
 from stellar_sdk.call_builder.call_builder_async import TransactionsCallBuilder as AsyncTransactionsCallBuilder
@@ -10,14 +12,15 @@ from stellar_sdk.call_builder.call_builder_async import OrderbookCallBuilder as
 from stellar_sdk.call_builder.call_builder_async.orderbook_call_builder import OrderbookCallBuilder
 from stellar_sdk.call_builder.call_builder_async.strict_send_paths_call_builder import StrictSendPathsCallBuilder
 from stellar_sdk.call_builder.call_builder_async.strict_receive_paths_call_builder import StrictReceivePathsCallBuilder
-from core.stellar import build_and_submit_transaction, has_trustline, load_account_async, parse_asset, get_recommended_fee
+from core.stellar import build_and_submit_transaction, has_trustline, build_trustline_index, load_account_async, parse_asset, get_recommended_fee
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG)
 
 def calculate_available_xlm(account):
-    xlm_balance = float(next((b["balance"] for b in account["balances"] if b["asset_type"] == "native"), "0"))
-    selling_liabilities = float(next((b["selling_liabilities"] for b in account["balances"] if b["asset_type"] == "native"), "0"))
+    native = build_trustline_index(account).get(("native", None))
+    xlm_balance = float(native["balance"]) if native else 0.0
+    selling_liabilities = float(native["selling_liabilities"]) if native else 0.0
     subentry_count = account["subentry_count"]
     num_sponsoring = account.get("num_sponsoring", 0)
     num_sponsored = account.get("num_sponsored", 0)
@@ -25,12 +28,15 @@ def calculate_available_xlm(account):
     available_xlm = xlm_balance - selling_liabilities - minimum_reserve
     return max(available_xlm, 0)
 
-async def wait_for_transaction_confirmation(tx_hash, app_context, max_attempts=60, interval=1):
-    attempts = 0
-    while attempts < max_attempts:
+async def wait_for_transaction_confirmation(tx_hash, app_context, max_attempts=60, interval=1, initial_delay=0.3):
+    # Back off from initial_delay up to interval; total wait window stays max_attempts * interval
+    deadline = time.monotonic() + max_attempts * interval
+    delay = initial_delay
+    while time.monotonic() < deadline:
         try:
             builder = AsyncTransactionsCallBuilder(horizon_url=app_context.horizon_url, client=app_context.client).transaction(tx_hash)
-            tx = await builder.call()
+            async with app_context.confirm_semaphore:
+                tx = await builder.call()
             if tx["successful"]:
                 logger.info(f"Transaction {tx_hash} confirmed successfully")
                 return True
@@ -39,12 +45,12 @@ async def wait_for_transaction_confirmation(tx_hash, app_context, max_attempts=6
                 raise ValueError(f"Transaction {tx_hash} failed")
         except Exception as e:
             if "404" in str(e):
-                await asyncio.sleep(interval)
-                attempts += 1
+                await asyncio.sleep(delay + random.uniform(0, 0.1))
+                delay = min(interval, delay * 1.6)
             else:
                 logger.error(f"Error checking transaction {tx_hash}: {str(e)}", exc_info=True)
                 raise
-    raise ValueError(f"Transaction {tx_hash} not confirmed after {max_attempts} attempts")
+    raise ValueError(f"Transaction {tx_hash} not confirmed after {max_attempts * interval} seconds")
 
 async def perform_buy(telegram_id, db_pool, asset_code, asset_issuer, amount, app_context):
     if not asset_issuer.startswith('G') or len(asset_issuer) != 56:
@@ -332,23 +338,25 @@ async def perform_sell(telegram_id, db_pool, asset_code, asset_issuer, amount, a
         raise ValueError(f"Sell failed (PPSS)")
 
 async def perform_withdraw(telegram_id, db_pool, asset, amount, destination, app_context):
-    public_key = await app_context.load_public_key(telegram_id)
-    account = await load_account_async(public_key, app_context)
-
-    try:
-        Keypair.from_public_key(destination)
-    except:
+    # Reject a bad destination before touching the DB or Horizon
+    if not StrKey.is_valid_ed25519_public_key(destination):
         raise ValueError("Invalid destination address")
 
-    fee = await get_recommended_fee(app_context) / 10000000
+    user_data = await app_context.load_signing_user(telegram_id)
+    public_key = user_data["public_key"]
+    account = await load_account_async(public_key, app_context)
+
+    # Exact 7-decimal arithmetic; amount may arrive as a Decimal or a number
+    amount = Decimal(str(amount)).quantize(Decimal('0.0000001'))
+    fee = Decimal(await get_recommended_fee(app_context)) / 10000000
     if asset.is_native():
-        current_xlm = float(next((b["balance"] for b in account["balances"] if b["asset_type"] == "native"), "0"))
-        base_reserve = 2 + (account["subentry_count"] + account.get("num_sponsoring", 0) - account.get("num_sponsored", 0)) * 0.5
+        current_xlm = Decimal(next((b["balance"] for b in account["balances"] if b["asset_type"] == "native"), "0"))
+        base_reserve = 2 + (account["subentry_count"] + account.get("num_sponsoring", 0) - account.get("num_sponsored", 0)) * Decimal("0.5")
         max_withdrawable = current_xlm - base_reserve - fee
         if amount > max_withdrawable:
             raise ValueError(f"Insufficient XLM: maximum withdrawable is {max_withdrawable} XLM")
     else:
-        asset_balance = float(next((b["balance"] for b in account["balances"] if b["asset_code"] == asset.code and b["asset_issuer"] == asset.issuer), "0"))
+        asset_balance = Decimal(next((b["balance"] for b in account["balances"] if b.get("asset_code") == asset.code and b.get("asset_issuer") == asset.issuer), "0"))
         if amount > asset_balance:
             raise ValueError(f"Insufficient {asset.code} balance: {asset_balance}")
         available_xlm = calculate_available_xlm(account)
@@ -358,10 +366,10 @@ async def perform_withdraw(telegram_id, db_pool, asset, amount, destination, app
     operations = [Payment(
         destination=destination,
         asset=asset,
-        amount=str(round(amount, 7))
+        amount=format(amount, 'f')
     )]
 
-    response, xdr = await build_and_submit_transaction(telegram_id, db_pool, operations, app_context, memo="Withdrawal")
+    response, xdr = await build_and_submit_transaction(telegram_id, db_pool, operations, app_context, memo="Withdrawal", user_data=user_data)
     await wait_for_transaction_confirmation(response["hash"], app_context)
     return response
 
@@ -415,7 +423,8 @@ async def perform_add_trustline(telegram_id, db_pool, asset_code, asset_issuer,
     if asset is None:
         raise ValueError(f"Invalid asset: {asset_code}:{asset_issuer}")
     
-    public_key = await app_context.load_public_key(telegram_id)
+    user_data = await app_context.load_signing_user(telegram_id)
+    public_key = user_data["public_key"]
     account = await load_account_async(public_key, app_context)
     
     if await has_trustline(account, asset):
@@ -429,7 +438,8 @@ async def perform_add_trustline(telegram_id, db_pool, asset_code, asset_issuer,
     operations = [ChangeTrust(asset=asset, limit="1000000000.0")]
     
     response, xdr = await build_and_submit_transaction(
-        telegram_id, db_pool, operations, app_context, memo=f"Add Trust {asset_code}"
+        telegram_id, db_pool, operations, app_context, memo=f"Add Trust {asset_code}",
+        user_data=user_data
     )
     await wait_for_transaction_confirmation(response["hash"], app_context)
     return response
@@ -439,7 +449,8 @@ async def perform_remove_trustline(telegram_id, db_pool, asset_code, asset_issue
     if asset is None:
         raise ValueError(f"Invalid asset: {asset_code}:{asset_issuer}")
     
-    public_key = await app_context.load_public_key(telegram_id)
+    user_data = await app_context.load_signing_user(telegram_id)
+    public_key = user_data["public_key"]
     account = await load_account_async(public_key, app_context)
     
     if not await has_trustline(account, asset):
@@ -460,7 +471,8 @@ async def perform_remove_trustline(telegram_id, db_pool, asset_code, asset_issue
     operations = [ChangeTrust(asset=asset, limit="0")]
     
     response, xdr = await build_and_submit_transaction(
-        telegram_id, db_pool, operations, app_context, memo=f"Remove Trust {asset_code}"
+        telegram_id, db_pool, operations, app_context, memo=f"Remove Trust {asset_code}",
+        user_data=user_data
     )
     await wait_for_transaction_confirmation(response["hash"], app_context)
     return response
\ No newline at end of file